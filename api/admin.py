@@ -1,9 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import Group
+from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
-from .models import User, Tag, SinglePhoto, PhotoSeries, Collection
+from .models import User, Tag, SinglePhoto, PhotoSeries, Collection, Job, Subscription
 
 
 class SinglePhotoInLine(admin.TabularInline):
@@ -53,13 +55,13 @@ class SinglePhotoInLine(admin.TabularInline):
 
 class SinglePhotoAdmin(admin.ModelAdmin):
     model = SinglePhoto
-    readonly_fields = ("is_secret", "img")
+    readonly_fields = ("is_secret", "img", "width", "height", "bytes", "format")
 
     def img(self, obj):
         return mark_safe('<img src="{url}" style="max-height:400px;height:100%" />'.format(
             url=obj.photo.url,
-            width=obj.photo.width,
-            height=obj.photo.height,
+            width=obj.width,
+            height=obj.height,
             )
         )
 
@@ -77,12 +79,6 @@ class TagAdmin(admin.ModelAdmin):
 admin.site.register(Tag, TagAdmin)
 
 
-class PhotoSeriesAdmin(admin.ModelAdmin):
-    inlines = (SinglePhotoInLine, )
-    readonly_fields = ("is_secret", )
-    filter_horizontal = ('tag', 'collection')
-
-
 class PhotoSeriesCollectionInLine(admin.TabularInline):
     model = PhotoSeries.collection.through
     classes = ['collapse', ]
@@ -90,6 +86,17 @@ class PhotoSeriesCollectionInLine(admin.TabularInline):
     show_change_link = True
 
 
+class PhotoSeriesAdmin(admin.ModelAdmin):
+    inlines = (SinglePhotoInLine, PhotoSeriesCollectionInLine)
+    readonly_fields = ("is_secret", )
+    filter_horizontal = ('tag', )
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # the inline writes the through rows directly, without m2m_changed
+        PhotoSeries.objects.filter(pk=form.instance.pk).refresh_visibility()
+
+
 class PhotoSeriesInLine(admin.TabularInline):
     model = PhotoSeries
     classes = ['collapse', ]
@@ -99,14 +106,22 @@ class PhotoSeriesInLine(admin.TabularInline):
 
 class CollectionAdmin(admin.ModelAdmin):
     inlines = (PhotoSeriesCollectionInLine,)
-    fields = ('name', 'cover', 'cover_img', 'description', 'is_secret', 'owner', 'created_at')
-    readonly_fields = ("cover_img", )
+    fields = ('name', 'cover', 'cover_img', 'cover_width', 'cover_height', 'cover_bytes', 'cover_format',
+              'description', 'is_secret', 'owner', 'created_at')
+    readonly_fields = ("cover_img", 'cover_width', 'cover_height', 'cover_bytes', 'cover_format')
+
+    def save_related(self, request, form, formsets, change):
+        series_ids = set(form.instance.collections_series.values_list('pk', flat=True)) if change else set()
+        super().save_related(request, form, formsets, change)
+        # the inline writes the through rows directly, without m2m_changed
+        series_ids.update(form.instance.collections_series.values_list('pk', flat=True))
+        PhotoSeries.objects.filter(pk__in=series_ids).refresh_visibility()
 
     def cover_img(self, obj):
         return mark_safe('<img src="{url}" style="max-height:400px;height:100%" />'.format(
             url=obj.cover.url,
-            width=obj.cover.width,
-            height=obj.cover.height,
+            width=obj.cover_width,
+            height=obj.cover_height,
             )
         )
 
@@ -118,9 +133,40 @@ class CollectionInLine(admin.TabularInline):
     show_change_link = True
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('started_at', 'finished_at', 'error')
+
+
 admin.site.register(SinglePhoto, SinglePhotoAdmin)
 admin.site.register(PhotoSeries, PhotoSeriesAdmin)
 admin.site.register(Collection, CollectionAdmin)
+admin.site.register(Job, JobAdmin)
+
+
+class SubscriptionAdmin(admin.ModelAdmin):
+    """
+    Paginated list of the subscription rows, linked from the user page
+    filtered by account or subscriber. Read only: rows written here would
+    bypass the counters and timelines kept by api.signals, subscriptions are
+    changed through the API.
+    """
+    list_display = ('id', 'from_user', 'to_user')
+    list_select_related = ('from_user', 'to_user')
+    raw_id_fields = ('from_user', 'to_user')
+    ordering = ('-id', )
+    # no COUNT(*) of the whole table on every page
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 class UserAdmin(admin.ModelAdmin):
@@ -135,20 +181,31 @@ class UserAdmin(admin.ModelAdmin):
         }),
         ("Profile info", {
             'classes': ('collapse',),
-            'fields': ('subscribers', 'profile_pic', 'avatar_img', 'check_mark', 'description', 'location', 'instagram_url', 'vk_url', 'sex')
+            'fields': ('subscribers_count', 'subscribed_to_count', 'subscriptions', 'profile_pic', 'avatar_img', 'profile_pic_width', 'profile_pic_height',
+                       'profile_pic_bytes', 'profile_pic_format', 'check_mark', 'description', 'location', 'instagram_url', 'vk_url', 'sex')
         })
     )
-    readonly_fields = ['avatar_img', ]
-    filter_horizontal = ('subscribers', )
+    readonly_fields = ['avatar_img', 'profile_pic_width', 'profile_pic_height', 'profile_pic_bytes', 'profile_pic_format',
+                       'subscribers_count', 'subscribed_to_count', 'subscriptions']
+
+    def subscriptions(self, obj):
+        if obj.pk is None:
+            return '-'
+        changelist = reverse('admin:api_subscription_changelist')
+        return format_html(
+            '<a href="{}?from_user__id__exact={}">subscribers</a> / <a href="{}?to_user__id__exact={}">following</a>',
+            changelist, obj.pk, changelist, obj.pk,
+        )
 
     def avatar_img(self, obj):
         return mark_safe('<img src="{url}" style="max-height:400px;height:100%" />'.format(
             url=obj.profile_pic.url,
-            width=obj.profile_pic.width,
-            height=obj.profile_pic.height,
+            width=obj.profile_pic_width,
+            height=obj.profile_pic_height,
             )
         )
 
 
 admin.site.register(User, UserAdmin)
+admin.site.register(Subscription, SubscriptionAdmin)
 admin.site.unregister(Group)
@@ -0,0 +1,97 @@
+"""
+JWT authentication that checks the user against a cache instead of the database.
+
+The token is decoded and validated by simplejwt as before. For read requests
+the fields deciding whether the user may authenticate (CACHED_FIELDS, and a
+marker that changes with the password, never the hash itself) are kept in a
+shared Django cache (AUTH_USER_CACHE_ALIAS) for AUTH_USER_CACHE_TIMEOUT
+seconds. request.user is then a `CachedUser`, which loads the row from the
+database only when something beyond those fields is used, so a view never
+saves columns read from the cache. Writes always authenticate against the
+database.
+
+api.signals deletes the entry after a user is saved or deleted, so a user
+deactivated with save() is rejected on their next request; other queryset
+updates are picked up when the entry expires. Without a cache shared by all
+workers every request reads the database.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import gettext_lazy as _
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .caches import shared_cache
+
+KEY_PREFIX = 'auth_user'
+# bumped when the cached fields change, so entries written by an older release are never read
+CACHE_VERSION = 2
+CACHED_FIELDS = ('pk', 'is_active', 'is_staff', 'is_superuser')
+
+
+def _key(user_id):
+    return f'{KEY_PREFIX}:{user_id}'
+
+
+def invalidate_cached_users(ids):
+    cache = shared_cache(settings.AUTH_USER_CACHE_ALIAS)
+    if cache is None:
+        return
+    keys = [_key(pk) for pk in ids]
+    # after the commit, so a concurrent request can't cache the old row again
+    transaction.on_commit(lambda: cache.delete_many(keys, version=CACHE_VERSION))
+
+
+class CachedUser(SimpleLazyObject):
+    """
+    The user of a read request. The cached fields are answered from the cache
+    entry; any other attribute loads the row from the database, once.
+    """
+
+    def __init__(self, user_model, entry):
+        super().__init__(lambda: user_model._default_manager.get(pk=entry['pk']))
+        fields = {name: entry[name] for name in CACHED_FIELDS}
+        fields[user_model._meta.pk.attname] = entry['pk']
+        self.__dict__.update(fields, is_authenticated=True, is_anonymous=False)
+        self.__dict__['get_session_auth_hash'] = lambda: entry['session_auth_hash']
+
+    def __bool__(self):
+        # `request.user and request.user.is_authenticated` in permissions
+        return True
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def authenticate(self, request):
+        cache = shared_cache(settings.AUTH_USER_CACHE_ALIAS)
+        if cache is None or request.method not in SAFE_METHODS:
+            return super().authenticate(request)
+
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_cached_user(cache, validated_token), validated_token
+
+    def get_cached_user(self, cache, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+
+        entry = cache.get(_key(user_id), version=CACHE_VERSION)
+        if entry is None:
+            user = self.get_user(validated_token)
+            entry = {name: getattr(user, name) for name in CACHED_FIELDS}
+            entry['session_auth_hash'] = user.get_session_auth_hash()
+            cache.set(_key(user_id), entry, settings.AUTH_USER_CACHE_TIMEOUT, version=CACHE_VERSION)
+            return user
+
+        if not entry['is_active']:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        return CachedUser(self.user_model, entry)
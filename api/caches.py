@@ -0,0 +1,21 @@
+from django.core.cache import caches
+
+# backends whose entries live in one process, where a delete doesn't reach the other workers
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def shared_cache(alias):
+    """
+    Returns the cache `alias` when every worker sees the same entries, None
+    when it isn't configured or keeps its entries per process. Caches whose
+    invalidation must reach all workers are only enabled with a shared one.
+    """
+    if not alias:
+        return None
+    backend = caches[alias]
+    if f'{type(backend).__module__}.{type(backend).__name__}' in PROCESS_LOCAL_BACKENDS:
+        return None
+    return backend
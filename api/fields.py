@@ -0,0 +1,94 @@
+from django.db import models
+from PIL import Image
+
+# EXIF orientations that rotate the image by 90 degrees
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+EXIF_ORIENTATION = 0x0112
+
+
+def read_image_metadata(field_file, close=False):
+    """
+    Returns (width, height, bytes, format) of an image file. Only the header
+    is decoded; width and height are the displayed size after EXIF rotation.
+    """
+    file_pos = field_file.tell()
+    field_file.seek(0)
+    try:
+        with Image.open(field_file) as image:
+            width, height = image.size
+            if image.getexif().get(EXIF_ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+                width, height = height, width
+            image_format = image.format or ''
+        return width, height, field_file.size, image_format
+    finally:
+        if close:
+            field_file.close()
+        else:
+            field_file.seek(file_pos)
+
+
+class MeasuredImageField(models.ImageField):
+    """
+    ImageField that stores the byte size and format of the image next to its
+    width and height, so they are read from the file once, when it is assigned.
+
+    `color_field` and `placeholder_field` hold the placeholder rendered by
+    api.thumbnails after the upload and are cleared when the file changes.
+    """
+
+    def __init__(self, verbose_name=None, name=None, bytes_field=None, format_field=None,
+                 color_field=None, placeholder_field=None, **kwargs):
+        self.bytes_field, self.format_field = bytes_field, format_field
+        self.color_field, self.placeholder_field = color_field, placeholder_field
+        super().__init__(verbose_name, name, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.bytes_field:
+            kwargs['bytes_field'] = self.bytes_field
+        if self.format_field:
+            kwargs['format_field'] = self.format_field
+        if self.color_field:
+            kwargs['color_field'] = self.color_field
+        if self.placeholder_field:
+            kwargs['placeholder_field'] = self.placeholder_field
+        return name, path, args, kwargs
+
+    @property
+    def metadata_fields(self):
+        return self.width_field, self.height_field, self.bytes_field, self.format_field
+
+    @property
+    def placeholder_fields(self):
+        return self.color_field, self.placeholder_field
+
+    def update_dimension_fields(self, instance, force=False, *args, **kwargs):
+        if force and self.attname in instance.__dict__:
+            # a new file was assigned, its placeholder is rendered after save
+            for field in self.placeholder_fields:
+                if field:
+                    setattr(instance, field, '')
+
+        fields = [field for field in self.metadata_fields if field]
+        if not fields or self.attname not in instance.__dict__:
+            return
+
+        file = getattr(instance, self.attname)
+        # rows loaded from the database are never measured here, even with
+        # empty metadata: opening the file on post_init would cost a read per
+        # row, legacy rows are filled by backfill_image_metadata
+        if not force and (not file or file._committed):
+            return
+
+        metadata = (None, None, None, '')
+        if file:
+            try:
+                file_closed = file.closed
+                file.open()
+                metadata = read_image_metadata(file, close=file_closed)
+            except (OSError, SyntaxError, ValueError):
+                # missing or unreadable file, left empty for backfill_image_metadata
+                pass
+        for field, value in zip(self.metadata_fields, metadata):
+            if field:
+                setattr(instance, field, value)
@@ -0,0 +1,145 @@
+"""
+Database backed background jobs.
+
+`enqueue` inserts a `Job` row in the caller's transaction, so a job exists
+exactly when the data it works on was committed. `manage.py run_jobs` polls
+the table and runs the jobs in a thread pool. A job is claimed with a
+conditional UPDATE from queued to running, which only one worker can win on
+any database, failed jobs are retried with exponential backoff until
+`max_attempts`, and jobs left running by a crashed worker are queued again
+once their lease expires.
+
+Handlers are registered with the `job` decorator in the module that owns
+the work and get the job payload as keyword arguments.
+"""
+import time
+import traceback
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+Handler = namedtuple('Handler', ['func', 'max_attempts', 'concurrency'])
+
+RETRY_DELAY = 10
+STALE_CHECK_INTERVAL = 60
+
+handlers = {}
+
+
+def job(kind, max_attempts=3, concurrency=None):
+    """
+    Registers the decorated function as the handler of `kind` jobs. At most
+    `concurrency` of them run at the same time in one worker.
+    """
+    def register(func):
+        handlers[kind] = Handler(func, max_attempts, concurrency)
+        return func
+    return register
+
+
+def enqueue(kind, owner_id=None, run_after=None, **payload):
+    return Job.objects.create(
+        kind=kind,
+        payload=payload,
+        owner_id=owner_id,
+        max_attempts=handlers[kind].max_attempts,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def claim(kinds):
+    """
+    Marks the next due job of one of `kinds` as running and returns it, or
+    None when there is nothing to do.
+    """
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now, kind__in=kinds) \
+        .order_by('run_after', 'pk').values_list('pk', flat=True)
+    for pk in due[:10]:
+        # only one worker sees the row still queued
+        claimed = Job.objects.filter(pk=pk, status=Job.QUEUED) \
+            .update(status=Job.RUNNING, started_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job):
+    handler = handlers[job.kind]
+    try:
+        handler.func(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, error=error, run_after=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, error=error, finished_at=timezone.now())
+    else:
+        Job.objects.filter(pk=job.pk).update(status=Job.DONE, error='', finished_at=timezone.now())
+    finally:
+        # jobs run in pool threads, each with its own connection
+        connections.close_all()
+
+
+def requeue_stale():
+    """
+    Queues again the running jobs whose worker didn't finish them within
+    JOB_LEASE seconds, or fails them when they have no attempts left.
+    Returns the number of queued jobs.
+    """
+    expired = Job.objects.filter(
+        status=Job.RUNNING, started_at__lt=timezone.now() - timedelta(seconds=settings.JOB_LEASE),
+    )
+    expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, error='The worker running the job stopped.', finished_at=timezone.now(),
+    )
+    return expired.update(status=Job.QUEUED)
+
+
+def work(concurrency=1, kinds=None, burst=False, poll_interval=1.0):
+    """
+    Runs jobs until interrupted, or until the queue is empty with `burst`.
+    """
+    kinds = set(kinds or handlers)
+    running = {}
+    last_stale_check = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while True:
+            if time.monotonic() - last_stale_check > STALE_CHECK_INTERVAL:
+                requeue_stale()
+                last_stale_check = time.monotonic()
+
+            for future in [future for future in running if future.done()]:
+                del running[future]
+
+            claimed = False
+            while len(running) < concurrency:
+                busy = Counter(running.values())
+                allowed = [
+                    kind for kind in kinds
+                    if handlers[kind].concurrency is None or busy[kind] < handlers[kind].concurrency
+                ]
+                job = claim(allowed) if allowed else None
+                if job is None:
+                    break
+                running[pool.submit(run, job)] = job.kind
+                claimed = True
+
+            if claimed:
+                continue
+            if not running:
+                if burst:
+                    return
+                time.sleep(poll_interval)
+            else:
+                wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
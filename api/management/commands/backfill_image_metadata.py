@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from api.fields import read_image_metadata
+from api.models import Collection, SinglePhoto, User
+
+IMAGE_FIELDS = (
+    (SinglePhoto, 'photo'),
+    (Collection, 'cover'),
+    (User, 'profile_pic'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Fills the stored width, height, byte size and format of images uploaded before they were recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Files read at the same time')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--all', action='store_true', help='Also re-read images that already have metadata')
+
+    def handle(self, *args, **options):
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for model, field_name in IMAGE_FIELDS:
+                filled, missing = self.backfill(pool, model, field_name, options)
+                self.stdout.write(self.style.SUCCESS(
+                    f'{model.__name__}.{field_name}: filled {filled}, unreadable {missing}'
+                ))
+
+    def backfill(self, pool, model, field_name, options):
+        field = model._meta.get_field(field_name)
+        queryset = model.objects.exclude(**{field_name: ''})
+        if not options['all']:
+            queryset = queryset.filter(**{f'{field.width_field}__isnull': True})
+        # plain rows, model instances would read every file again in post_init
+        rows = queryset.order_by('pk').values_list('pk', field_name)
+
+        filled = missing = 0
+        last_pk = None
+        while True:
+            batch = list((rows.filter(pk__gt=last_pk) if last_pk is not None else rows)[:options['batch_size']])
+            if not batch:
+                return filled, missing
+            last_pk = batch[-1][0]
+
+            updated = []
+            names = [name for _, name in batch]
+            for (pk, _), metadata in zip(batch, pool.map(lambda name: self.read(field.storage, name), names)):
+                if metadata is None:
+                    missing += 1
+                    continue
+                updated.append(model(pk=pk, **dict(zip(field.metadata_fields, metadata))))
+            model.objects.bulk_update(updated, field.metadata_fields)
+            filled += len(updated)
+
+    def read(self, storage, name):
+        try:
+            with storage.open(name) as file:
+                return read_image_metadata(file)
+        except (OSError, SyntaxError, ValueError):
+            return None
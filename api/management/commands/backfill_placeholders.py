@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.models import Collection, SinglePhoto
+from api.placeholders import render_placeholders
+
+IMAGE_FIELDS = (
+    (SinglePhoto, 'photo'),
+    (Collection, 'cover'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Renders the missing low resolution placeholders of photos and collection covers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--chunk-size', type=int, default=50, help='Images rendered by one pool task')
+
+    def handle(self, *args, **options):
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for model, field_name in IMAGE_FIELDS:
+                filled, missing = self.backfill(pool, model, field_name, options)
+                self.stdout.write(self.style.SUCCESS(
+                    f'{model.__name__}.{field_name}: filled {filled}, unreadable {missing}'
+                ))
+
+    def backfill(self, pool, model, field_name, options):
+        field = model._meta.get_field(field_name)
+        rows = model.objects.exclude(**{field_name: ''}).filter(**{field.color_field: ''}) \
+            .order_by('pk').values_list('pk', field_name)
+
+        filled = missing = 0
+        last_pk = None
+        while True:
+            batch = list((rows.filter(pk__gt=last_pk) if last_pk is not None else rows)[:options['batch_size']])
+            if not batch:
+                return filled, missing
+            last_pk = batch[-1][0]
+
+            paths = [field.storage.path(name) for _, name in batch]
+            chunks = [paths[start:start + options['chunk_size']] for start in range(0, len(paths), options['chunk_size'])]
+            placeholders = [placeholder for chunk in pool.map(render_placeholders, chunks) for placeholder in chunk]
+
+            updated = []
+            for (pk, _), placeholder in zip(batch, placeholders):
+                if placeholder is None:
+                    missing += 1
+                    continue
+                updated.append(model(pk=pk, **dict(zip(field.placeholder_fields, placeholder))))
+            model.objects.bulk_update(updated, field.placeholder_fields)
+            filled += len(updated)
@@ -0,0 +1,29 @@
+from random import random
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from api.models import PhotoSeries
+
+
+class Command(BaseCommand):
+    help = 'Gives a fresh PhotoSeries.random_rank to the series sharing one, like the rows that existed ' \
+           'when the column was added, or to every series with --all'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Reshuffle the whole feed')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        series = PhotoSeries.objects.all()
+        if not options['all']:
+            shared = PhotoSeries.objects.values('random_rank').annotate(rows=Count('pk')).filter(rows__gt=1)
+            series = series.filter(random_rank__in=shared.values('random_rank'))
+
+        updated = 0
+        series_ids = list(series.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(series_ids), options['batch_size']):
+            batch = series_ids[start:start + options['batch_size']]
+            PhotoSeries.objects.bulk_update([PhotoSeries(pk=pk, random_rank=random()) for pk in batch], ['random_rank'])
+            updated += len(batch)
+        self.stdout.write(self.style.SUCCESS(f'Gave a new random rank to {updated} photo series'))
@@ -0,0 +1,59 @@
+from random import random
+from statistics import median
+from time import perf_counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import PhotoSeries
+
+DEFAULT_SIZES = '1000,10000,100000,1000000,10000000'
+INSERT_BATCH_SIZE = 10000
+
+
+class Command(BaseCommand):
+    help = 'Measures PhotoSeries.objects.sample() on growing tables in a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Comma separated table sizes')
+        parser.add_argument('-n', type=int, default=10, help='Series drawn per sample')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--naive', action='store_true',
+                            help='Also time loading the whole table into a list (slow on big tables)')
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._run(sizes, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, sizes, options):
+        owner = get_user_model().objects.create_user('benchmark', 'benchmark@example.com', 'benchmark')
+        public = PhotoSeries.objects.public()
+        self.stdout.write(f'{"rows":>10} {"sample ms":>10} {"naive ms":>10}')
+        for size in sizes:
+            self._fill(owner, size)
+            timings = []
+            for _ in range(options['repeat']):
+                started = perf_counter()
+                public.sample(options['n'])
+                timings.append(perf_counter() - started)
+            naive = ''
+            if options['naive']:
+                started = perf_counter()
+                list(public.all())
+                naive = f'{(perf_counter() - started) * 1000:.2f}'
+            self.stdout.write(f'{size:>10} {median(timings) * 1000:>10.2f} {naive:>10}')
+
+    def _fill(self, owner, size):
+        missing = size - PhotoSeries.objects.count()
+        while missing > 0:
+            batch = min(missing, INSERT_BATCH_SIZE)
+            # bulk_create skips the indexing signals, which are not measured here
+            PhotoSeries.objects.bulk_create(
+                PhotoSeries(name='benchmark', owner=owner, random_rank=random()) for _ in range(batch)
+            )
+            missing -= batch
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.recommendations import BATCH_SIZE, TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the tag based recommendations of the photo series whose tags changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Recompute every photo series')
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        count = build_recommendations(options['all'], options['top_k'], options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Recomputed recommendations of {count} photo series'))
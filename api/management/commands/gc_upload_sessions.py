@@ -0,0 +1,36 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import UploadSession
+from api.uploads import discard_session_files, uploads_root
+
+
+class Command(BaseCommand):
+    help = 'Deletes the chunked upload sessions that received nothing for UPLOAD_SESSION_TTL seconds, ' \
+           'and part files left without a session'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int, default=settings.UPLOAD_SESSION_TTL, help='Seconds since the last chunk')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=options['ttl'])
+        expired = list(UploadSession.objects.filter(updated_at__lt=cutoff).values_list('pk', flat=True))
+        UploadSession.objects.filter(pk__in=expired).delete()
+        for session_id in expired:
+            discard_session_files(session_id)
+
+        # directories of sessions deleted along with their owner, or before a crash removed the files
+        orphans = 0
+        if os.path.isdir(uploads_root()):
+            live = {str(pk) for pk in UploadSession.objects.values_list('pk', flat=True)}
+            for entry in os.scandir(uploads_root()):
+                if entry.name not in live and entry.stat().st_mtime < cutoff.timestamp():
+                    discard_session_files(entry.name)
+                    orphans += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {len(expired)} expired upload sessions and {orphans} orphaned upload directories'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api.models import PhotoSeries
+from api.search import REINDEX_BATCH_SIZE, create_postgres_indexes, reindex_series
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the search documents (and the SQLite inverted index) of every photo series'
+
+    def handle(self, *args, **options):
+        create_postgres_indexes()
+        series_ids = list(PhotoSeries.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(series_ids), REINDEX_BATCH_SIZE):
+            reindex_series(series_ids[start:start + REINDEX_BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {len(series_ids)} photo series'))
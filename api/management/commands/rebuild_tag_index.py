@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.tag_index import rebuild_postings
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the tag -> photo series posting lists from the tag through table'
+
+    def handle(self, *args, **options):
+        count = rebuild_postings()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt posting lists of {count} tags'))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from api.models import User
+from api.user_cache import invalidate_short_infos
+
+
+def counted(column):
+    # number of subscription rows with `column` pointing at the outer user
+    rows = User.subscribers.through.objects.filter(**{column: OuterRef('pk')}).order_by() \
+        .values(column).annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(rows), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Recomputes User.subscribers_count and subscribed_to_count from the subscriptions, ' \
+           'or only reports drift with --check'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only count the users with wrong counters')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drifted = User.objects.annotate(
+            real_subscribers=counted('from_user'),
+            real_subscribed_to=counted('to_user'),
+        ).filter(~Q(subscribers_count=F('real_subscribers')) | ~Q(subscribed_to_count=F('real_subscribed_to')))
+        if options['check']:
+            drift = drifted.count()
+            style = self.style.SUCCESS if not drift else self.style.ERROR
+            self.stdout.write(style(f'{drift} users have wrong subscription counters'))
+            return
+
+        user_ids = list(drifted.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(user_ids), options['batch_size']):
+            with transaction.atomic():
+                # counter updates of concurrent subscriptions wait for the recount under the row locks
+                batch = list(User.objects.select_for_update().filter(pk__in=user_ids[start:start + options['batch_size']])
+                             .values_list('pk', flat=True))
+                User.objects.filter(pk__in=batch).update(
+                    subscribers_count=counted('from_user'),
+                    subscribed_to_count=counted('to_user'),
+                )
+                invalidate_short_infos(batch)
+        self.stdout.write(self.style.SUCCESS(f'Fixed the subscription counters of {len(user_ids)} users'))
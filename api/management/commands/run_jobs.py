@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.jobs import handlers, work
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs, see api.jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Jobs run at the same time')
+        parser.add_argument('--kind', action='append', help='Only run jobs of this kind, can be repeated')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls of an empty queue')
+
+    def handle(self, *args, **options):
+        unknown = set(options['kind'] or ()) - set(handlers)
+        if unknown:
+            raise CommandError(f'Unknown job kinds: {", ".join(sorted(unknown))}')
+        try:
+            work(options['concurrency'], options['kind'], options['burst'], options['poll_interval'])
+        except KeyboardInterrupt:
+            # jobs cut short are queued again once their lease expires
+            pass
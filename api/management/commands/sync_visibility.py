@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from api.models import PhotoSeries
+
+
+class Command(BaseCommand):
+    help = 'Recomputes PhotoSeries.is_public from collection secrecy, or only reports drift with --check'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only count the series with a wrong flag')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        in_secret_collection = PhotoSeries.collection.through.objects.filter(
+            collection__is_secret=True,
+        ).values('photoseries_id')
+        if options['check']:
+            drift = PhotoSeries.objects.filter(is_public=True, pk__in=in_secret_collection).count() \
+                + PhotoSeries.objects.filter(is_public=False).exclude(pk__in=in_secret_collection).count()
+            style = self.style.SUCCESS if not drift else self.style.ERROR
+            self.stdout.write(style(f'{drift} photo series have a wrong is_public flag'))
+            return
+
+        changed = 0
+        series_ids = list(PhotoSeries.objects.order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(series_ids), options['batch_size']):
+            batch = series_ids[start:start + options['batch_size']]
+            changed += PhotoSeries.objects.filter(pk__in=batch).refresh_visibility()
+        self.stdout.write(self.style.SUCCESS(f'Fixed is_public of {changed} photo series'))
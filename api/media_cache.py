@@ -0,0 +1,106 @@
+"""
+Path -> visibility cache for the unsigned media urls checked by IsNotSecret.
+
+Entries live in a Django cache (MEDIA_VISIBILITY_CACHE_ALIAS) shared by all
+workers; without a shared cache every check reads the database, since an
+invalidation in one worker's memory wouldn't reach the others. Single paths
+are dropped by the signals in api.signals when a photo or a cover changes;
+any series visibility change bumps a generation number instead, which
+invalidates every entry at once. Both happen after the writing transaction
+commits, so a concurrent check can't cache the rows it replaces. The hit
+and miss counters are kept in the same cache, so they add up all workers.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .caches import shared_cache
+from .models import Collection, SinglePhoto
+
+KEY_PREFIX = 'media_visibility'
+GENERATION_KEY = f'{KEY_PREFIX}:generation'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+
+class MediaVisibilityCache:
+    def __init__(self, loader, timeout, cache_alias=None):
+        self.loader = loader
+        self.timeout = timeout
+        self.cache_alias = cache_alias
+
+    @property
+    def shared(self):
+        return shared_cache(self.cache_alias)
+
+    def get(self, path):
+        """
+        Returns (is_public, owner_ids) of the media file at `path`.
+        """
+        cache = self.shared
+        if cache is None:
+            return self.loader(path)
+
+        found = cache.get_many([GENERATION_KEY, self._key(path)])
+        # read before loading, an invalidation during the load leaves the entry stale
+        generation = found.get(GENERATION_KEY, 0)
+        entry = found.get(self._key(path))
+        if entry is not None and entry[0] == generation:
+            self._increment(cache, HITS_KEY)
+            return entry[1]
+        self._increment(cache, MISSES_KEY)
+        value = self.loader(path)
+        cache.set(self._key(path), (generation, value), self.timeout)
+        return value
+
+    def invalidate(self, path):
+        cache = self.shared
+        if cache is not None:
+            transaction.on_commit(lambda: cache.delete(self._key(path)))
+
+    def invalidate_all(self):
+        cache = self.shared
+        if cache is not None:
+            transaction.on_commit(lambda: self._bump_generation(cache))
+
+    def stats(self):
+        cache = self.shared
+        counters = cache.get_many([HITS_KEY, MISSES_KEY]) if cache is not None else {}
+        return {
+            'hits': counters.get(HITS_KEY, 0),
+            'misses': counters.get(MISSES_KEY, 0),
+            'shared': cache is not None,
+        }
+
+    def _key(self, path):
+        return f'{KEY_PREFIX}:{path}'
+
+    def _bump_generation(self, cache):
+        self._increment(cache, GENERATION_KEY)
+
+    def _increment(self, cache, key):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # the first increment, or the key was evicted; add() loses to a concurrent first one
+            if not cache.add(key, 1, None):
+                cache.incr(key)
+
+
+def load_media_visibility(path):
+    owner_ids, is_public = set(), None
+    for owner_id, series_is_public in SinglePhoto.objects.filter(photo=path) \
+            .values_list('owner_id', 'series__is_public'):
+        owner_ids.add(owner_id)
+        is_public = is_public or series_is_public
+    for owner_id, is_secret in Collection.objects.filter(cover=path).values_list('owner_id', 'is_secret'):
+        owner_ids.add(owner_id)
+        is_public = is_public or not is_secret
+    # files that belong to nothing (avatars, site images) are public
+    return (True if is_public is None else is_public), frozenset(owner_ids)
+
+
+media_visibility_cache = MediaVisibilityCache(
+    load_media_visibility,
+    timeout=settings.MEDIA_VISIBILITY_CACHE_TIMEOUT,
+    cache_alias=settings.MEDIA_VISIBILITY_CACHE_ALIAS,
+)
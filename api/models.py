@@ -1,16 +1,20 @@
 from __future__ import annotations
 
 import os
+import uuid
+from random import random, shuffle
 
 from django.contrib.auth.hashers import make_password
 from django.core.validators import FileExtensionValidator
-from django.db import models
+from django.db import models, transaction
+from django.dispatch import Signal
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 from django.contrib import auth
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.apps import apps
 
+from .fields import MeasuredImageField
 from .validators import CustomUnicodeUsernameValidator
 from pytils.translit import slugify
 
@@ -21,6 +25,15 @@ def transliterate_filename(filename):
     return f'{name}{ext}'
 
 
+class MediaBlob(models.Model):
+    # a file of api.storage.ContentAddressedStorage and the number of fields referencing it
+    name = models.CharField(max_length=255, primary_key=True)
+    refcount = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
 class Tag(models.Model):
     tag = models.CharField(max_length=20, blank=False, null=False)
 
@@ -33,18 +46,37 @@ class SinglePhoto(models.Model):
         path = f'pictures/photos/{transliterate_filename(filename)}'
         return path
 
-    photo = models.ImageField(
+    photo = MeasuredImageField(
         null=False,
         blank=False,
         upload_to=get_image_path,
         validators=[
             FileExtensionValidator(['png', 'jpg', 'gif'])
         ],
+        width_field='width',
+        height_field='height',
+        bytes_field='bytes',
+        format_field='format',
+        color_field='placeholder_color',
+        placeholder_field='placeholder',
     )
+    # filled from the file by MeasuredImageField
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    bytes = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    format = models.CharField(max_length=10, blank=True, default='', editable=False)
+    # dominant color and inline thumbnail, see api.placeholders
+    placeholder_color = models.CharField(max_length=7, blank=True, default='', editable=False)
+    placeholder = models.TextField(blank=True, default='', editable=False)
     owner = models.ForeignKey("User", on_delete=models.CASCADE, related_name='user_photos', blank=False, null=False)
     series = models.ForeignKey("PhotoSeries", on_delete=models.CASCADE, related_name='series_photos', blank=False, null=False)
     order = models.IntegerField(null=False, blank=False, default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['series', 'order']),
+        ]
+
     def __str__(self):
         return self.photo.name
 
@@ -52,28 +84,199 @@ class SinglePhoto(models.Model):
         return self.series.is_secret()
 
 
+# sent by PhotoSeriesQuerySet.refresh_visibility when some is_public flag changed
+series_visibility_changed = Signal()
+
+
+class PhotoSeriesQuerySet(models.QuerySet):
+    def public(self):
+        return self.filter(is_public=True)
+
+    def refresh_visibility(self):
+        """
+        Recomputes `is_public` for the series of this queryset from the
+        secrecy of their collections. Returns the number of changed rows.
+        """
+        in_secret_collection = self.model.collection.through.objects.filter(
+            collection__is_secret=True,
+        ).values('photoseries_id')
+        series = self.model.objects.filter(pk__in=self.values('pk'))
+        changed = series.filter(is_public=True, pk__in=in_secret_collection).update(is_public=False)
+        changed += series.filter(is_public=False).exclude(pk__in=in_secret_collection).update(is_public=True)
+        if changed:
+            series_visibility_changed.send(sender=self.model)
+        return changed
+
+    def sample(self, n, probes=3):
+        """
+        Returns up to `n` random series of this queryset in bounded time.
+
+        Every probe reads a short run of rows from a random point of the indexed
+        `random_rank` column, wrapping around to the start when it runs out, so
+        the cost depends on `n` and `probes` but not on the table size.
+        """
+        picked = {}
+        run_size = max(1, -(-n // probes))
+        for _ in range(probes * 2):  # extra attempts for runs that overlap
+            if len(picked) >= n:
+                break
+            start = random()
+            run = list(self.filter(random_rank__gte=start).order_by('random_rank')[:run_size])
+            if len(run) < run_size:
+                run += list(self.filter(random_rank__lt=start).order_by('random_rank')[:run_size - len(run)])
+            for obj in run:
+                picked.setdefault(obj.pk, obj)
+            if len(run) < run_size:
+                break  # the whole queryset has been read
+        result = list(picked.values())[:n]
+        shuffle(result)
+        return result
+
+
 class PhotoSeries(models.Model):
     name = models.CharField(max_length=40, blank=False, null=False)
     tag = models.ManyToManyField(Tag, blank=True, symmetrical=False, related_name='photo_series')
     description = models.TextField(max_length=300, blank=True, null=False)
     owner = models.ForeignKey("User", on_delete=models.CASCADE, related_name='user_series')
-    collection = models.ManyToManyField("Collection", blank=True, symmetrical=False, related_name='collections_series')
+    collection = models.ManyToManyField(
+        "Collection", blank=True, symmetrical=False, related_name='collections_series', through='CollectionSeries',
+    )
     # collection = models.ForeignKey("Collection", on_delete=models.SET_NULL, related_name='collection_series', blank=True, null=True)
     created_at = models.DateTimeField(default=timezone.now)
     price = models.DecimalField(max_digits=15, decimal_places=2, default=0.0, null=True, blank=True)
+    # False when the series is in at least one secret collection, maintained by api.signals
+    is_public = models.BooleanField(default=True, db_index=True, editable=False)
+    # position in the shuffled main page feed, see api.pagination.RandomFeedPagination;
+    # rows that existed before the column are given their own by backfill_random_rank
+    random_rank = models.FloatField(default=random, db_index=True, editable=False)
+    # name, tags and description as one text, maintained by api.search
+    search_document = models.TextField(blank=True, default='', editable=False)
+    # set when the tags change, cleared by api.recommendations
+    recommendations_stale = models.BooleanField(default=True, db_index=True, editable=False)
+    # set at creation when the owner had too many subscribers to push it into timelines, see api.timeline
+    is_pulled = models.BooleanField(default=False, editable=False)
+
+    objects = PhotoSeriesQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # timelines read the latest series of followed accounts, see api.timeline
+            models.Index(fields=['owner', '-created_at']),
+            models.Index(fields=['owner', '-created_at'], condition=models.Q(is_pulled=True),
+                         name='api_series_pulled_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
     def is_secret(self):
-        if self.collection:
-            is_secret = False
-            for collection in self.collection.all():
-                is_secret = is_secret or collection.is_secret
+        return not self.is_public
+
+
+class TagPostings(models.Model):
+    # sorted ids of the tag's series packed as uint64, maintained by api.tag_index
+    tag = models.OneToOneField(Tag, on_delete=models.CASCADE, primary_key=True, related_name='postings')
+    series_ids = models.BinaryField(default=bytes)
+
+    def __str__(self):
+        return str(self.tag)
+
+
+class SeriesRecommendation(models.Model):
+    # top similar series by tags, computed by api.recommendations
+    series = models.ForeignKey(PhotoSeries, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(PhotoSeries, on_delete=models.CASCADE, related_name='recommended_for')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['series', 'rank']),
+        ]
+
+    def __str__(self):
+        return f'{self.series_id} -> {self.recommended_id}'
+
+
+class TimelineEntry(models.Model):
+    # a series pushed into the home timeline of a subscriber of its owner, see api.timeline
+    user = models.ForeignKey("User", on_delete=models.CASCADE, related_name='timeline')
+    series = models.ForeignKey(PhotoSeries, on_delete=models.CASCADE, related_name='timeline_entries')
+    # copy of series.created_at, the timeline order
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('user', 'series')]
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-series']),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} <- {self.series_id}'
 
-            return is_secret
-        else:
-            return False
+
+class SearchTerm(models.Model):
+    # inverted index used by api.search when the database is not Postgres
+    term = models.CharField(max_length=64)
+    series = models.ForeignKey(PhotoSeries, on_delete=models.CASCADE, related_name='search_terms')
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'series']),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
+class UploadSession(models.Model):
+    # a photo series uploaded in chunks, see api.uploads
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey("User", on_delete=models.CASCADE, related_name='upload_sessions')
+    # PhotoSeriesSerializer data, validated again when the session is finalized
+    series_data = models.JSONField(default=dict)
+    # [{"name": ..., "size": ...}] in the order of the photos
+    files = models.JSONField(default=list)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return str(self.id)
+
+
+class Job(models.Model):
+    # a unit of background work, queued and run by api.jobs
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'queued'),
+        (RUNNING, 'running'),
+        (DONE, 'done'),
+        (FAILED, 'failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    owner = models.ForeignKey("User", on_delete=models.CASCADE, related_name='jobs', blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk}'
 
 
 class Collection(models.Model):
@@ -81,14 +284,26 @@ class Collection(models.Model):
         path = f'pictures/covers/{transliterate_filename(filename)}'
         return path
 
-    cover = models.ImageField(
+    cover = MeasuredImageField(
         null=False,
         blank=False,
         upload_to=get_image_path,
         validators=[
             FileExtensionValidator(['png', 'jpg', 'gif'])
         ],
+        width_field='cover_width',
+        height_field='cover_height',
+        bytes_field='cover_bytes',
+        format_field='cover_format',
+        color_field='cover_placeholder_color',
+        placeholder_field='cover_placeholder',
     )
+    cover_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    cover_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    cover_bytes = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    cover_format = models.CharField(max_length=10, blank=True, default='', editable=False)
+    cover_placeholder_color = models.CharField(max_length=7, blank=True, default='', editable=False)
+    cover_placeholder = models.TextField(blank=True, default='', editable=False)
 
     name = models.CharField(max_length=40, blank=False, null=False)
     description = models.TextField(max_length=150, blank=True, null=False)
@@ -99,6 +314,62 @@ class Collection(models.Model):
     def __str__(self):
         return self.name
 
+    def update_series(self, add=(), remove=(), order=()):
+        """
+        Adds the series ids `add` to the end of the collection, removes the
+        ids `remove` and moves the ids `order` to the start in that order.
+        Every id of `add` must belong to a series of the collection owner,
+        the unknown ones are returned and nothing is changed.
+        """
+        with transaction.atomic():
+            owned = set(PhotoSeries.objects.filter(pk__in=add, owner_id=self.owner_id).values_list('pk', flat=True))
+            unknown = [pk for pk in add if pk not in owned]
+            if unknown:
+                return unknown
+
+            rows = CollectionSeries.objects.filter(collection=self)
+            removed = set(remove) - set(add)
+            if removed:
+                rows.filter(photoseries_id__in=removed).delete()
+
+            positions = dict(rows.values_list('photoseries_id', 'order'))
+            last = max(positions.values(), default=-1)
+            added = [pk for pk in dict.fromkeys(add) if pk not in positions]
+            CollectionSeries.objects.bulk_create([
+                CollectionSeries(photoseries_id=pk, collection=self, order=last + 1 + index)
+                for index, pk in enumerate(added)
+            ], ignore_conflicts=True)
+            positions.update((pk, last + 1 + index) for index, pk in enumerate(added))
+
+            if order:
+                moved = [pk for pk in dict.fromkeys(order) if pk in positions]
+                # the moved series go before every other one, which keep their relative order
+                first = min(positions.values(), default=0) - len(moved)
+                rows.filter(photoseries_id__in=moved).update(order=models.Case(
+                    *[models.When(photoseries_id=pk, then=first + index) for index, pk in enumerate(moved)],
+                ))
+
+            if self.is_secret and (added or removed):
+                PhotoSeries.objects.filter(pk__in=[*added, *removed]).refresh_visibility()
+        return []
+
+
+class CollectionSeries(models.Model):
+    # the former auto-created PhotoSeries.collection table, with the position of the series in the collection
+    photoseries = models.ForeignKey(PhotoSeries, on_delete=models.CASCADE)
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE)
+    order = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'api_photoseries_collection'
+        unique_together = [('photoseries', 'collection')]
+        indexes = [
+            models.Index(fields=['collection', 'order']),
+        ]
+
+    def __str__(self):
+        return f'{self.collection_id}: {self.photoseries_id}'
+
 
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -189,14 +460,20 @@ class User(AbstractBaseUser, PermissionsMixin):
     date_joined = models.DateTimeField(_('date joined'), default=timezone.now)
 
     # profile features
-    subscribers = models.ManyToManyField('self', blank=True, symmetrical=False, related_name='subscribed_to')
+    subscribers = models.ManyToManyField(
+        'self', blank=True, symmetrical=False, related_name='subscribed_to',
+        through='Subscription', through_fields=('from_user', 'to_user'),
+    )
+    # kept in step with `subscribers` by api.signals, repaired by reconcile_subscription_counts
+    subscribers_count = models.PositiveIntegerField(default=0, editable=False)
+    subscribed_to_count = models.PositiveIntegerField(default=0, editable=False)
 
     def get_image_path(self, filename):
         print("filename", filename)
         path = f'pictures/avatars/{transliterate_filename(filename)}'
         return path
 
-    profile_pic = models.ImageField(
+    profile_pic = MeasuredImageField(
         null=False,
         blank=False,
         upload_to=get_image_path,
@@ -204,7 +481,15 @@ class User(AbstractBaseUser, PermissionsMixin):
             FileExtensionValidator(['png', 'jpg', 'gif'])
         ],
         default='site/default.jpg',
+        width_field='profile_pic_width',
+        height_field='profile_pic_height',
+        bytes_field='profile_pic_bytes',
+        format_field='profile_pic_format',
     )
+    profile_pic_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    profile_pic_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    profile_pic_bytes = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    profile_pic_format = models.CharField(max_length=10, blank=True, default='', editable=False)
     check_mark = models.BooleanField(_('check mark'), default=False, blank=False, null=False)
     description = models.TextField(max_length=150, blank=True, null=False)
     location = models.CharField(max_length=50, blank=True, null=False)
@@ -282,3 +567,20 @@ class User(AbstractBaseUser, PermissionsMixin):
 #         else:
 #             old_avatar.delete(save=False)
 
+
+class Subscription(models.Model):
+    # the former auto-created User.subscribers table: `to_user` is subscribed to `from_user`
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        db_table = 'api_user_subscribers'
+        unique_together = [('from_user', 'to_user')]
+        indexes = [
+            # subscriber and subscription lists are paged by row id, see api.pagination.SubscriptionPagination
+            models.Index(fields=['from_user', 'id']),
+            models.Index(fields=['to_user', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.to_user_id} -> {self.from_user_id}'
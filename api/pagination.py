@@ -0,0 +1,141 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from random import random
+from urllib import parse
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+
+
+def encode_cursor(tokens):
+    querystring = parse.urlencode(tokens)
+    return urlsafe_b64encode(querystring.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(encoded):
+    try:
+        padding = '=' * (-len(encoded) % 4)
+        querystring = urlsafe_b64decode((encoded + padding).encode('ascii')).decode('ascii')
+        return {key: values[0] for key, values in parse.parse_qs(querystring, strict_parsing=True).items()}
+    except (TypeError, ValueError):
+        raise NotFound('Invalid cursor')
+
+
+class RandomFeedPagination(BasePagination):
+    """
+    Keyset pagination over `PhotoSeries.random_rank`.
+
+    The feed order is the rank order rotated by a per-session seed: rows with
+    rank >= seed come first, then the rows below the seed. Both phases are
+    index range scans, so a page costs the same regardless of the table size,
+    and the cursor pins the seed so following pages never repeat or skip rows.
+    """
+    page_size = 10
+    cursor_query_param = 'cursor'
+    next_cursor_header = 'X-Next-Cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            tokens = decode_cursor(encoded)
+            try:
+                seed = float(tokens['s'])
+                phase = int(tokens['p'])
+                rank = float(tokens['r'])
+                pk = int(tokens['i'])
+            except (KeyError, ValueError):
+                raise NotFound('Invalid cursor')
+            after = Q(random_rank__gt=rank) | Q(random_rank=rank, pk__gt=pk)
+        else:
+            seed, phase, after = random(), 0, Q()
+
+        page = []
+        if phase == 0:
+            page = [(0, obj) for obj in self._fetch(
+                queryset.filter(Q(random_rank__gte=seed) & after), self.page_size + 1
+            )]
+            after = Q()
+        if len(page) <= self.page_size:
+            page += [(1, obj) for obj in self._fetch(
+                queryset.filter(Q(random_rank__lt=seed) & after), self.page_size + 1 - len(page)
+            )]
+
+        self.next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            last_phase, last = page[-1]
+            self.next_cursor = encode_cursor({
+                's': repr(seed),
+                'p': last_phase,
+                'r': repr(last.random_rank),
+                'i': last.pk,
+            })
+        return [obj for _, obj in page]
+
+    def _fetch(self, queryset, limit):
+        return list(queryset.order_by('random_rank', 'pk')[:limit])
+
+    def add_cursor_header(self, response):
+        if self.next_cursor:
+            response[self.next_cursor_header] = self.next_cursor
+        return response
+
+
+class CollectionSeriesPagination(BasePagination):
+    """
+    Keyset pagination over the `CollectionSeries` rows of a collection in
+    their (order, pk) order, which the (collection, order) index serves
+    directly.
+    """
+    page_size = 20
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            tokens = decode_cursor(encoded)
+            try:
+                order = int(tokens['o'])
+                pk = int(tokens['i'])
+            except (KeyError, ValueError):
+                raise NotFound('Invalid cursor')
+            queryset = queryset.filter(Q(order__gt=order) | Q(order=order, pk__gt=pk))
+
+        page = list(queryset.order_by('order', 'pk')[:self.page_size + 1])
+        self.next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            self.next_cursor = encode_cursor({'o': page[-1].order, 'i': page[-1].pk})
+        return page
+
+
+class SubscriptionPagination(BasePagination):
+    """
+    Keyset pagination over `Subscription` rows by id. Subscriber and
+    subscription lists are read from the (from_user, id) and (to_user, id)
+    indexes, so a page costs the same for any number of subscribers.
+    """
+    page_size = 20
+    cursor_query_param = 'cursor'
+    next_cursor_header = 'X-Next-Cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            try:
+                pk = int(decode_cursor(encoded)['i'])
+            except (KeyError, ValueError):
+                raise NotFound('Invalid cursor')
+            queryset = queryset.filter(pk__gt=pk)
+
+        page = list(queryset.order_by('pk')[:self.page_size + 1])
+        self.next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            self.next_cursor = encode_cursor({'i': page[-1].pk})
+        return page
+
+    def add_cursor_header(self, response):
+        if self.next_cursor:
+            response[self.next_cursor_header] = self.next_cursor
+        return response
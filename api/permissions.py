@@ -1,7 +1,8 @@
 from rest_framework.permissions import BasePermission, SAFE_METHODS
-from django.shortcuts import get_object_or_404
 
-from .models import SinglePhoto, PhotoSeries, Collection
+from .media_cache import media_visibility_cache
+from .media_signing import EXPIRES_PARAM, SIGNATURE_PARAM, verify_media_signature
+from .thumbnails import original_name
 
 
 class IsOwnerOrStuff(BasePermission):
@@ -18,20 +19,24 @@ class IsOwnerOrStuff(BasePermission):
         return obj.owner == request.user or request.user.is_staff
 
 
-class IsNotSecret(BasePermission): # add req obj secret assertion
+class HasValidMediaSignature(BasePermission):
     def has_permission(self, request, view):
-        url = view.kwargs.get("path")
+        return verify_media_signature(
+            view.kwargs.get("path"),
+            request.query_params.get(EXPIRES_PARAM),
+            request.query_params.get(SIGNATURE_PARAM),
+        )
 
-        single_photo_obj = SinglePhoto.objects.filter(photo=url).first()
-        if single_photo_obj:
-            return single_photo_obj.owner == request.user or not single_photo_obj.is_secret()
 
-        collection_obj = Collection.objects.filter(cover=url).first()
-        if collection_obj:
-            print(collection_obj.owner, request.user)
-            return collection_obj.owner == request.user or not collection_obj.is_secret
+class IsNotSecret(BasePermission): # add req obj secret assertion
+    def has_permission(self, request, view):
+        url = view.kwargs.get("path")
+        if url is None:
+            return True
 
-        return True
+        # derivatives share the visibility of their original image
+        is_public, owner_ids = media_visibility_cache.get(original_name(url))
+        return is_public or request.user.pk in owner_ids
 
     def has_object_permission(self, request, view, obj):
         return obj.is_secret
@@ -0,0 +1,68 @@
+"""
+Low resolution placeholders shown while the real images load.
+
+A placeholder is the dominant color of the image and a 16px WebP inlined as a
+data URI. Images are shrunk with Pillow and the color is picked with NumPy
+over a whole batch at once: pixels are quantized into 4 bit per channel
+buckets and the mean of the most populated bucket wins, which keeps a small
+saturated subject from turning the color into a muddy average.
+"""
+from base64 import b64encode
+from io import BytesIO
+
+import numpy as np
+from PIL import Image, ImageOps
+
+SIZE = 16
+QUALITY = 60
+# pixels per image used for the color, every image is resampled to a square
+SAMPLE = SIZE * SIZE
+BUCKETS = 16 ** 3
+
+
+def _load(path):
+    with Image.open(path) as image:
+        # JPEGs are decoded straight at a reduced scale
+        image.draft('RGB', (SIZE * 4, SIZE * 4))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        sample = np.asarray(image.resize((SIZE, SIZE), Image.BOX), dtype=np.uint8).reshape(SAMPLE, 3)
+        image.thumbnail((SIZE, SIZE), Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format='WEBP', quality=QUALITY)
+    return 'data:image/webp;base64,' + b64encode(buffer.getvalue()).decode('ascii'), sample
+
+
+def dominant_colors(samples):
+    """
+    Returns the dominant color of every image of an (images, pixels, 3) uint8
+    array as an (images, 3) array.
+    """
+    count = len(samples)
+    quantized = (samples >> 4).astype(np.int64)
+    buckets = quantized[..., 0] * 256 + quantized[..., 1] * 16 + quantized[..., 2]
+    # one bincount for the whole batch, each image gets its own range of buckets
+    offsets = np.arange(count)[:, None] * BUCKETS
+    histogram = np.bincount((buckets + offsets).ravel(), minlength=count * BUCKETS).reshape(count, BUCKETS)
+    in_top = buckets == histogram.argmax(axis=1)[:, None]
+    totals = (samples * in_top[..., None]).sum(axis=1)
+    return (totals / in_top.sum(axis=1)[:, None]).round().astype(np.uint8)
+
+
+def render_placeholders(paths):
+    """
+    Returns a (color, data URI) pair for every image path, None for the files
+    that can't be read.
+    """
+    loaded = {}
+    for index, path in enumerate(paths):
+        try:
+            loaded[index] = _load(path)
+        except (OSError, SyntaxError, ValueError):
+            continue
+
+    result = [None] * len(paths)
+    if loaded:
+        colors = dominant_colors(np.stack([sample for _, sample in loaded.values()]))
+        for (index, (data_uri, _)), color in zip(loaded.items(), colors):
+            result[index] = ('#{:02x}{:02x}{:02x}'.format(*color), data_uri)
+    return result
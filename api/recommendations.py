@@ -0,0 +1,108 @@
+"""
+Tag co-occurrence recommendations.
+
+Series are compared by the Jaccard similarity of their tag sets. The
+candidates of a batch of series are gathered from the tag posting lists
+(api.tag_index), scored with NumPy and the top K are stored in
+`SeriesRecommendation`, so the recommendations endpoint is a single indexed
+read. Series whose tags changed are marked `recommendations_stale` and are
+the only ones recomputed by an incremental build.
+"""
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+
+from .models import PhotoSeries, SeriesRecommendation, TagPostings
+from .tag_index import TYPECODE
+
+TOP_K = 20
+BATCH_SIZE = 500
+# only the newest series of very popular tags are used as candidates
+MAX_POSTINGS_PER_TAG = 5000
+
+
+def load_postings():
+    """
+    Returns the capped candidate postings of every tag and the number of
+    tags of every tagged public series, as sorted (series ids, counts) arrays.
+    Both are sized by the number of series, not by the largest id.
+    """
+    public_ids = np.fromiter(PhotoSeries.objects.public().values_list('pk', flat=True), dtype=np.int64)
+    postings, all_postings = {}, []
+    for tag_id, blob in TagPostings.objects.values_list('tag_id', 'series_ids').iterator():
+        # packed by api.tag_index as native uint64
+        ids = np.frombuffer(bytes(blob), dtype=np.dtype(TYPECODE)).astype(np.int64)
+        ids = ids[np.isin(ids, public_ids, assume_unique=True)]
+        all_postings.append(ids)
+        postings[tag_id] = ids[-MAX_POSTINGS_PER_TAG:]
+
+    if not all_postings:
+        return postings, (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+    return postings, np.unique(np.concatenate(all_postings), return_counts=True)
+
+
+def score_batch(series_ids, series_tags, postings, tag_counts, top_k=TOP_K):
+    """
+    Scores every (series, candidate) pair of the batch at once and returns
+    {series id: [(candidate id, jaccard), ...]} with at most `top_k` entries.
+    """
+    rows, candidates = [], []
+    for row, tags in enumerate(series_tags):
+        for tag_id in tags:
+            ids = postings.get(tag_id)
+            if ids is not None and len(ids):
+                rows.append(np.full(len(ids), row, dtype=np.int64))
+                candidates.append(ids)
+    if not candidates:
+        return {}
+
+    rows, candidates = np.concatenate(rows), np.concatenate(candidates)
+    width = int(candidates.max()) + 1
+    pairs, shared = np.unique(rows * width + candidates, return_counts=True)
+    rows, candidates = pairs // width, pairs % width
+
+    own_counts = np.array([len(tags) for tags in series_tags], dtype=np.int64)
+    # every candidate comes from the postings, so it is in the counted ids
+    counted_ids, counts = tag_counts
+    scores = shared / (own_counts[rows] + counts[np.searchsorted(counted_ids, candidates)] - shared)
+
+    keep = candidates != np.asarray(series_ids, dtype=np.int64)[rows]
+    rows, candidates, scores = rows[keep], candidates[keep], scores[keep]
+
+    # by series, best score first, newest candidate first on ties
+    order = np.lexsort((-candidates, -scores, rows))
+    rows, candidates, scores = rows[order], candidates[order], scores[order]
+    position = np.arange(len(rows)) - np.searchsorted(rows, rows, side='left')
+    top = position < top_k
+
+    result = defaultdict(list)
+    for row, candidate, score in zip(rows[top].tolist(), candidates[top].tolist(), scores[top].tolist()):
+        result[series_ids[row]].append((candidate, score))
+    return result
+
+
+def build_recommendations(rebuild_all=False, top_k=TOP_K, batch_size=BATCH_SIZE):
+    series = PhotoSeries.objects.all() if rebuild_all else PhotoSeries.objects.filter(recommendations_stale=True)
+    series_ids = list(series.order_by('pk').values_list('pk', flat=True))
+    if not series_ids:
+        return 0
+    postings, tag_counts = load_postings()
+
+    for start in range(0, len(series_ids), batch_size):
+        batch = series_ids[start:start + batch_size]
+        tags = defaultdict(list)
+        tag_rows = PhotoSeries.tag.through.objects.filter(photoseries_id__in=batch)
+        for series_id, tag_id in tag_rows.values_list('photoseries_id', 'tag_id'):
+            tags[series_id].append(tag_id)
+
+        scored = score_batch(batch, [tags[series_id] for series_id in batch], postings, tag_counts, top_k)
+        with transaction.atomic():
+            SeriesRecommendation.objects.filter(series_id__in=batch).delete()
+            SeriesRecommendation.objects.bulk_create(
+                SeriesRecommendation(series_id=series_id, recommended_id=candidate, rank=rank, score=score)
+                for series_id, recommended in scored.items()
+                for rank, (candidate, score) in enumerate(recommended)
+            )
+            PhotoSeries.objects.filter(pk__in=batch).update(recommendations_stale=False)
+    return len(series_ids)
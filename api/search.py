@@ -0,0 +1,149 @@
+"""
+Full-text search over PhotoSeries name, description and tag names.
+
+Every series keeps a plain text `search_document` that is rebuilt by the
+signals in api.signals whenever the series or its tags change. On Postgres
+the document is matched through GIN indexes (russian tsvector + trigram) that
+are created after migrate. Other backends (SQLite in development) use the
+`SearchTerm` inverted index filled with snowball-stemmed terms instead.
+"""
+import re
+import threading
+from collections import defaultdict
+
+import snowballstemmer
+from django.db import connections, transaction
+from django.db.models import OuterRef, Q, Subquery, Sum
+
+from .models import PhotoSeries, SearchTerm
+
+SEARCH_CONFIG = 'russian'
+REINDEX_BATCH_SIZE = 500
+
+# relevance of a term depending on where it was found
+NAME_WEIGHT = 3
+TAG_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+POSTGRES_INDEXES = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # must match the SQL that SearchVector('search_document', config='russian') compiles to
+    "CREATE INDEX IF NOT EXISTS api_photoseries_search_tsv ON api_photoseries "
+    "USING gin (to_tsvector('russian'::regconfig, COALESCE(search_document, '')))",
+    "CREATE INDEX IF NOT EXISTS api_photoseries_search_trgm ON api_photoseries "
+    "USING gin (search_document gin_trgm_ops)",
+)
+
+_local = threading.local()
+
+
+def uses_postgres(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def _stemmer():
+    # snowball stemmers keep state while stemming, so one per thread
+    if not hasattr(_local, 'stemmer'):
+        _local.stemmer = snowballstemmer.stemmer(SEARCH_CONFIG)
+    return _local.stemmer
+
+
+def tokenize(text):
+    words = TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+    return [stem[:SearchTerm._meta.get_field('term').max_length] for stem in _stemmer().stemWords(words)]
+
+
+def build_document(name, tag_names, description):
+    return '\n'.join([name, ' '.join(tag_names), description])
+
+
+def weighted_terms(name, tag_names, description):
+    terms = defaultdict(int)
+    for text, weight in ((name, NAME_WEIGHT), (' '.join(tag_names), TAG_WEIGHT), (description, DESCRIPTION_WEIGHT)):
+        for term in tokenize(text):
+            terms[term] += weight
+    return terms
+
+
+def reindex_series(series_ids):
+    series_ids = list(series_ids)
+    for start in range(0, len(series_ids), REINDEX_BATCH_SIZE):
+        _reindex_batch(series_ids[start:start + REINDEX_BATCH_SIZE])
+
+
+def _reindex_batch(series_ids):
+    tag_names = defaultdict(list)
+    tag_rows = PhotoSeries.tag.through.objects.filter(photoseries_id__in=series_ids)
+    for series_id, tag_name in tag_rows.values_list('photoseries_id', 'tag__tag'):
+        tag_names[series_id].append(tag_name)
+
+    series = list(PhotoSeries.objects.filter(pk__in=series_ids).only('pk', 'name', 'description'))
+    terms = []
+    for obj in series:
+        obj.search_document = build_document(obj.name, tag_names[obj.pk], obj.description)
+        if not uses_postgres():
+            terms += [
+                SearchTerm(term=term, series_id=obj.pk, weight=weight)
+                for term, weight in weighted_terms(obj.name, tag_names[obj.pk], obj.description).items()
+            ]
+
+    with transaction.atomic():
+        PhotoSeries.objects.bulk_update(series, ['search_document'])
+        if not uses_postgres():
+            SearchTerm.objects.filter(series_id__in=series_ids).delete()
+            SearchTerm.objects.bulk_create(terms)
+
+
+def search_series(queryset, query):
+    """
+    Narrows `queryset` to the series matching every word of `query` (the last
+    word may be incomplete) and orders it by relevance.
+    """
+    if not tokenize(query):
+        return queryset.none()
+    if uses_postgres(queryset.db):
+        return _search_postgres(queryset, query)
+    return _search_inverted_index(queryset, query)
+
+
+def _search_postgres(queryset, query):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    vector = SearchVector('search_document', config=SEARCH_CONFIG)
+    # TOKEN_RE only lets word characters through, so the raw tsquery is safe
+    words = TOKEN_RE.findall(query.lower())
+    ts_query = SearchQuery(' & '.join(f'{word}:*' for word in words), config=SEARCH_CONFIG, search_type='raw')
+    return queryset.annotate(
+        search_vector=vector,
+        search_rank=SearchRank(vector, ts_query),
+    ).filter(
+        # typos, through the trigram index (the % operator, pg_trgm.similarity_threshold)
+        Q(search_vector=ts_query) | Q(search_document__trigram_similar=query)
+    ).order_by('-search_rank', '-pk')
+
+
+def _prefix(term):
+    # a range instead of LIKE so that the term index is used
+    return Q(term__gte=term, term__lt=term + '\uffff')
+
+
+def _search_inverted_index(queryset, query):
+    terms = tokenize(query)
+    any_term = Q()
+    for term in terms:
+        queryset = queryset.filter(pk__in=SearchTerm.objects.filter(_prefix(term)).values('series'))
+        any_term |= _prefix(term)
+
+    score = SearchTerm.objects.filter(any_term, series=OuterRef('pk')) \
+        .values('series').annotate(total=Sum('weight')).values('total')
+    return queryset.annotate(search_rank=Subquery(score)).order_by('-search_rank', '-pk')
+
+
+def create_postgres_indexes(using='default', **kwargs):
+    if not uses_postgres(using):
+        return
+    with connections[using].cursor() as cursor:
+        for statement in POSTGRES_INDEXES:
+            cursor.execute(statement)
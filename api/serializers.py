@@ -1,13 +1,77 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.validators import FileExtensionValidator
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Subquery
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework.fields import SerializerMethodField
 from rest_framework.relations import PrimaryKeyRelatedField
 
-from .models import User, SinglePhoto, PhotoSeries, Tag, Collection
+from .media_cache import media_visibility_cache
+from .media_signing import signed_media_url
+from .models import User, SinglePhoto, PhotoSeries, Tag, Collection, CollectionSeries, UploadSession, Job
+from .pagination import CollectionSeriesPagination
+from .thumbnails import FORMATS, WIDTHS, derivative_name, schedule_image_processing
+from .uploads import received_bytes
 from rest_framework import serializers
 
 
+def may_sign(field, instance):
+    """
+    Whether the viewer of the serializer may get signed urls for the images
+    of `instance`: always for public media, otherwise only for the owner and
+    staff. The others get plain urls, which MediaAccess checks with IsNotSecret.
+    """
+    if isinstance(instance, SinglePhoto):
+        is_public = instance.series.is_public
+    elif isinstance(instance, Collection):
+        is_public = not instance.is_secret
+    else:
+        # avatars
+        return True
+    if is_public:
+        return True
+    request = field.context.get('request', None)
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and (user.is_staff or instance.owner_id == user.pk)
+
+
+def media_url(field, name, signed=True):
+    url = signed_media_url(name) if signed else default_storage.url(name)
+    request = field.context.get('request', None)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class SignedImageField(serializers.ImageField):
+    # renders a signed, expiring url that MediaAccess serves without a permission lookup
+    def to_representation(self, value):
+        if not value:
+            return None
+        return media_url(self, value.name, may_sign(self, value.instance))
+
+
+class SrcsetField(serializers.Field):
+    # {"200": {"webp": url, "jpg": url}, "600": ...} of the derivatives made by api.thumbnails
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        signed = may_sign(self, value.instance)
+        return {
+            str(width): {ext: media_url(self, derivative_name(value.name, width, ext), signed) for ext in FORMATS}
+            for width in WIDTHS
+        }
+
+
 class UserSerializer(UserSerializer):
-    profile_pic = serializers.ImageField(max_length=None, use_url=True, allow_null=True, required=False)
+    profile_pic = SignedImageField(max_length=None, use_url=True, allow_null=True, required=False)
+    profile_pic_srcset = SrcsetField(source='profile_pic')
 
     class Meta(UserSerializer.Meta):
         model = User
@@ -16,6 +80,11 @@ class UserSerializer(UserSerializer):
             'username',
             'email',
             'profile_pic',
+            'profile_pic_srcset',
+            'profile_pic_width',
+            'profile_pic_height',
+            'profile_pic_bytes',
+            'profile_pic_format',
             'first_name',
             'last_name',
             'description',
@@ -23,16 +92,24 @@ class UserSerializer(UserSerializer):
             'instagram_url',
             'vk_url',
             'sex',
+            'subscribers_count',
+            'subscribed_to_count',
         )
         read_only_fields = (
             'id',
             'username',
             'email',
+            'subscribers_count',
+            'subscribed_to_count',
+            'profile_pic_width',
+            'profile_pic_height',
+            'profile_pic_bytes',
+            'profile_pic_format',
         )
 
 
 class UserCreateSerializer(UserCreateSerializer):
-    profile_pic = serializers.ImageField(max_length=None, use_url=True, allow_null=True, required=False)
+    profile_pic = SignedImageField(max_length=None, use_url=True, allow_null=True, required=False)
 
     class Meta(UserCreateSerializer.Meta):
         model = User
@@ -53,7 +130,8 @@ class UserCreateSerializer(UserCreateSerializer):
 
 
 class UserShortSerializer(serializers.ModelSerializer):
-    profile_pic = serializers.ImageField(max_length=None, use_url=True, allow_null=True, required=False)
+    profile_pic = SignedImageField(max_length=None, use_url=True, allow_null=True, required=False)
+    profile_pic_srcset = SrcsetField(source='profile_pic')
 
     class Meta:
         model = User
@@ -61,6 +139,13 @@ class UserShortSerializer(serializers.ModelSerializer):
             'id',
             'username',
             'profile_pic',
+            'profile_pic_srcset',
+            'profile_pic_width',
+            'profile_pic_height',
+            'profile_pic_bytes',
+            'profile_pic_format',
+            'subscribers_count',
+            'subscribed_to_count',
         )
 
 
@@ -71,15 +156,32 @@ class TagSerializer(serializers.ModelSerializer):
 
 
 class SinglePhotoSerializer(serializers.ModelSerializer):
+    photo = SignedImageField(read_only=True)
+    photo_srcset = SrcsetField(source='photo')
+
     class Meta:
         model = SinglePhoto
-        fields = ['id', 'photo', 'order']
+        fields = ['id', 'photo', 'photo_srcset', 'width', 'height', 'bytes', 'format', 'placeholder_color', 'placeholder',
+                  'order']
 
 
 class SinglePhotoShortSerializer(serializers.ModelSerializer):
+    photo = SignedImageField(read_only=True)
+    photo_srcset = SrcsetField(source='photo')
+
     class Meta:
         model = SinglePhoto
-        fields = ['photo', ]
+        fields = ['photo', 'photo_srcset', 'width', 'height', 'bytes', 'format', 'placeholder_color', 'placeholder']
+
+
+def cover_photos_prefetch():
+    # only the first photo of every series, fetched in one query for the whole page
+    first_photo = SinglePhoto.objects.filter(series=OuterRef('series')).order_by('order', 'pk').values('pk')[:1]
+    return Prefetch(
+        'series_photos',
+        queryset=SinglePhoto.objects.filter(pk=Subquery(first_photo)),
+        to_attr='cover_photos',
+    )
 
 
 class PhotoSeriesRetrieveSerializer(serializers.ModelSerializer):
@@ -93,6 +195,14 @@ class PhotoSeriesRetrieveSerializer(serializers.ModelSerializer):
         model = PhotoSeries
         fields = ['id', 'name', 'owner', 'tag', 'description', 'collection', 'created_at', 'price', 'series_photos']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(
+            Prefetch('series_photos', queryset=SinglePhoto.objects.order_by('order', 'pk')),
+            'tag',
+            'collection',
+        )
+
     # def create(self, validated_data):
     #     print('val_data', validated_data)
     #     # photos_data = validated_data.pop('series_photos')
@@ -122,23 +232,56 @@ class PhotoSeriesRetrieveSerializer(serializers.ModelSerializer):
 
 
 class PhotoSeriesShortSerializer(serializers.ModelSerializer):
-    series_photos = SinglePhotoShortSerializer(many=True)
+    # lists only render the cover, see setup_eager_loading
+    series_photos = SinglePhotoShortSerializer(many=True, source='cover_photos')
 
     class Meta:
         model = PhotoSeries
         fields = ['id', 'name', 'series_photos']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(cover_photos_prefetch())
+
 
 class CollectionRetrieveSerializer(serializers.ModelSerializer):
-    # collection_series = PhotoSeriesGetSerializer(many=True)
+    cover = SignedImageField(read_only=True)
+    cover_srcset = SrcsetField(source='cover')
+    # one page of the series, see setup_series_page
+    collections_series = PhotoSeriesShortSerializer(many=True, read_only=True, source='series_page')
+    collections_series_cursor = serializers.CharField(read_only=True, allow_null=True, source='series_cursor')
 
     class Meta:
         model = Collection
-        fields = ['id', 'name', 'cover', 'description', 'owner', 'is_secret', 'created_at', 'collections_series']
+        fields = ['id', 'name', 'cover', 'cover_srcset', 'cover_width', 'cover_height', 'cover_bytes', 'cover_format',
+                  'cover_placeholder_color', 'cover_placeholder', 'description', 'owner', 'is_secret', 'created_at',
+                  'collections_series', 'collections_series_cursor']
+
+    @staticmethod
+    def setup_series_page(collection, request):
+        """
+        Loads the page of series of `collection` selected by the cursor of
+        `request`, with their covers, in a fixed number of queries. Only the
+        owner and staff see the series hidden by another secret collection.
+        """
+        rows = CollectionSeries.objects.filter(collection=collection)
+        if not (request.user == collection.owner or request.user.is_staff):
+            rows = rows.filter(photoseries__is_public=True)
+        paginator = CollectionSeriesPagination()
+        page = paginator.paginate_queryset(rows.only('pk', 'order', 'photoseries_id'), request)
+
+        series = PhotoSeriesShortSerializer.setup_eager_loading(
+            PhotoSeries.objects.filter(pk__in=[row.photoseries_id for row in page])
+        ).in_bulk()
+        collection.series_page = [series[row.photoseries_id] for row in page if row.photoseries_id in series]
+        collection.series_cursor = paginator.next_cursor
+        return collection
 
 
 class CollectionSerializer(serializers.ModelSerializer):
     # collection_series = PhotoSeriesGetSerializer(many=True)
+    cover = SignedImageField()
+    cover_srcset = SrcsetField(source='cover')
 
     def create(self, validated_data):
         request = self.context.get('request', None)
@@ -147,60 +290,158 @@ class CollectionSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Collection
-        fields = ['id', 'name', 'cover', 'description', 'is_secret']
+        fields = ['id', 'name', 'cover', 'cover_srcset', 'cover_width', 'cover_height', 'cover_bytes', 'cover_format',
+                  'cover_placeholder_color', 'cover_placeholder', 'description', 'is_secret']
+
+
+class CollectionSeriesUpdateSerializer(serializers.Serializer):
+    add = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    remove = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    order = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, default=list)
+    # the former name of `add`
+    series_id = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, write_only=True)
+
+    def validate(self, attrs):
+        attrs['add'] = attrs['add'] + attrs.pop('series_id', [])
+        if not (attrs['add'] or attrs['remove'] or attrs['order']):
+            raise serializers.ValidationError('Nothing to add, remove or order.')
+        return attrs
 
 
 class PhotoSeriesSerializer(serializers.ModelSerializer):
     # series_photo = serializers.ListSerializer(child=serializers.ImageField())
     # tag = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
     tag = serializers.ListField(child=serializers.CharField(), write_only=True)
+    # id of the job processing the uploaded photos, see api.jobs
+    job = SerializerMethodField()
+
+    def get_job(self, obj):
+        job = getattr(self, 'processing_job', None)
+        return job.pk if job else None
 
     def create(self, validated_data):
-        print("start")
         request = self.context.get('request', None)
-        print(request)
-        series_photo = request.data.getlist("series_photos[]")
+        # files of a finalized upload session, see UploadSessionFinalizeView
+        series_photo = self.context['series_photos'] if 'series_photos' in self.context \
+            else request.data.getlist("series_photos[]")
 
         desc = "" if validated_data.get('description') == "default" \
             else validated_data.get('description')
-        print(validated_data.get('description'))
-        print(desc)
 
+        try:
+            tag_names = [name.strip() for name in validated_data.get('tag')[0].split(",")]
+            tag_names = list(dict.fromkeys(name for name in tag_names if name))
+        except Exception as e:
+            tag_names = []
 
-        photo_series = PhotoSeries.objects.create(
-            name=validated_data.get('name'),
-            description=desc,
-            owner=request.user,
-            price=validated_data.get('price'),
-        )
+        photos = []
+        try:
+            with transaction.atomic():
+                photo_series = PhotoSeries.objects.create(
+                    name=validated_data.get('name'),
+                    description=desc,
+                    owner=request.user,
+                    price=validated_data.get('price'),
+                )
+                photo_series.tag.add(*self.resolve_tags(tag_names, create_missing=request.user.is_staff))
+
+                # the files are written by bulk_create, before the transaction commits
+                photos = [
+                    SinglePhoto(series=photo_series, order=i, photo=photo, owner=request.user)
+                    for i, photo in enumerate(series_photo)
+                ]
+                SinglePhoto.objects.bulk_create(photos)
+                self.processing_job = self.photos_saved(photo_series)
+        except Exception:
+            saved = [photo.photo.name for photo in photos if photo.photo and photo.photo._committed]
+            if saved:
+                SinglePhoto._meta.get_field('photo').storage.discard_unreferenced(saved)
+            raise
 
-        # request.user.is_staff
+        return photo_series
 
-        try:
-            tags = validated_data.get('tag')[0].split(",")
-            for i in range(len(tags)):
-                tags[i] = tags[i].strip()
-        except Exception as e:
-            tags = []
+    @staticmethod
+    def resolve_tags(tag_names, create_missing):
+        """
+        Returns the ids of the tags named `tag_names`, creating the missing
+        ones when `create_missing` is set.
+        """
+        def by_name():
+            ids = {}
+            for pk, name in Tag.objects.filter(tag__in=tag_names).order_by('pk').values_list('pk', 'tag'):
+                ids.setdefault(name, pk)
+            return ids
+
+        ids = by_name()
+        missing = [name for name in tag_names if name not in ids]
+        if missing and create_missing:
+            Tag.objects.bulk_create([Tag(tag=name) for name in missing])
+            # not every backend returns the ids of bulk inserted rows
+            ids = by_name()
+        return [ids[name] for name in tag_names if name in ids]
+
+    @staticmethod
+    def photos_saved(photo_series):
+        """
+        Does the work of the SinglePhoto post_save receivers, which bulk_create
+        skips, with a single processing job for the whole series.
+        """
+        # reloaded, not every backend returns the ids of bulk inserted rows
+        photos = list(SinglePhoto.objects.filter(series=photo_series))
+        for photo in photos:
+            media_visibility_cache.invalidate(photo.photo.name)
+        return schedule_image_processing(*[photo.photo for photo in photos], owner_id=photo_series.owner_id)
 
-        for tag_name in tags:
-            tag_search = Tag.objects.filter(tag=tag_name)
-            if len(tag_search) > 0:
-                photo_series.tag.add(tag_search[0].id)
-            elif request.user.is_staff:
-                new_tag = Tag.objects.create(tag=tag_name)
-                photo_series.tag.add(new_tag)
+    class Meta:
+        model = PhotoSeries
+        fields = ['id', 'name', 'tag', 'description', 'price', 'job']
 
 
-        # for tag_pk in validated_data.get('tag'):
-        #     photo_series.tag.add(tag_pk)
+class UploadFileSerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=100)
+    size = serializers.IntegerField(min_value=1, max_value=settings.UPLOAD_MAX_FILE_SIZE)
 
-        for i in range(len(series_photo)):
-            SinglePhoto.objects.create(series=photo_series, order=i, photo=series_photo[i], owner=request.user)
+    def validate_name(self, value):
+        # the same extensions as SinglePhoto.photo
+        FileExtensionValidator(['png', 'jpg', 'gif'])(File(None, name=value))
+        return value
 
-        return photo_series
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    series = serializers.JSONField(source='series_data', write_only=True)
+    files = UploadFileSerializer(many=True)
+
+    def validate_series(self, value):
+        serializer = PhotoSeriesSerializer(data=value)
+        if not serializer.is_valid():
+            raise serializers.ValidationError(serializer.errors)
+        return value
+
+    def validate_files(self, value):
+        if not value:
+            raise serializers.ValidationError('At least one file is required.')
+        if len(value) > settings.UPLOAD_SESSION_MAX_FILES:
+            raise serializers.ValidationError(f'At most {settings.UPLOAD_SESSION_MAX_FILES} files are allowed.')
+        return [dict(file) for file in value]
+
+    def create(self, validated_data):
+        request = self.context.get('request', None)
+        return UploadSession.objects.create(owner=request.user, **validated_data)
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        for index, file in enumerate(data['files']):
+            # the client resumes every file from its received offset
+            file['index'] = index
+            file['received'] = received_bytes(instance, index)
+        return data
 
     class Meta:
-        model = PhotoSeries
-        fields = ['id', 'name', 'tag', 'description', 'price']
+        model = UploadSession
+        fields = ['id', 'series', 'files', 'created_at', 'updated_at']
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'attempts', 'max_attempts', 'created_at', 'started_at', 'finished_at']
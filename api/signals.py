@@ -0,0 +1,197 @@
+from collections import Counter
+
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .authentication import invalidate_cached_users
+from .media_cache import media_visibility_cache
+from .models import Collection, PhotoSeries, SinglePhoto, Tag, User, series_visibility_changed
+from .search import reindex_series
+from .tag_index import add_postings, remove_postings
+from .thumbnails import schedule_image_processing
+from .timeline import schedule_fan_out, subscribed, unsubscribed
+from .user_cache import invalidate_short_infos
+
+
+# search and tag indexes
+@receiver(post_save, sender=PhotoSeries)
+def index_saved_series(sender, instance, **kwargs):
+    reindex_series([instance.pk])
+
+
+@receiver(m2m_changed, sender=PhotoSeries.tag.through)
+def series_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        related = instance.photo_series if reverse else instance.tag
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    tag_ids, series_ids = ([instance.pk], pk_set) if reverse else (pk_set, [instance.pk])
+    if action == 'post_add':
+        add_postings(tag_ids, series_ids)
+    else:
+        remove_postings(tag_ids, series_ids)
+    reindex_series(series_ids)
+    PhotoSeries.objects.filter(pk__in=series_ids).update(recommendations_stale=True)
+
+
+@receiver(pre_delete, sender=PhotoSeries)
+def unindex_deleted_series(sender, instance, **kwargs):
+    remove_postings(instance.tag.values_list('pk', flat=True), [instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+def index_renamed_tag(sender, instance, created, **kwargs):
+    if not created:
+        reindex_series(instance.photo_series.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_series(sender, instance, **kwargs):
+    instance._deleted_series_ids = list(instance.photo_series.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def index_deleted_tag(sender, instance, **kwargs):
+    reindex_series(instance.__dict__.pop('_deleted_series_ids', []))
+
+
+# series visibility
+@receiver(m2m_changed, sender=PhotoSeries.collection.through)
+def series_collections_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        instance._cleared_series_pks = set(
+            instance.collections_series.values_list('pk', flat=True) if reverse else [instance.pk]
+        )
+        return
+    if action == 'post_clear':
+        series_ids = instance.__dict__.pop('_cleared_series_pks', set())
+    elif action in ('post_add', 'post_remove'):
+        series_ids = pk_set if reverse else [instance.pk]
+    else:
+        return
+    PhotoSeries.objects.filter(pk__in=series_ids).refresh_visibility()
+
+
+@receiver(post_save, sender=Collection)
+def collection_secrecy_changed(sender, instance, created, **kwargs):
+    if not created:
+        PhotoSeries.objects.filter(collection=instance).refresh_visibility()
+
+
+@receiver(pre_delete, sender=Collection)
+def remember_collection_series(sender, instance, **kwargs):
+    instance._deleted_series_ids = list(instance.collections_series.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Collection)
+def refresh_deleted_collection_series(sender, instance, **kwargs):
+    PhotoSeries.objects.filter(pk__in=instance.__dict__.pop('_deleted_series_ids', [])).refresh_visibility()
+
+
+# media visibility cache
+@receiver(series_visibility_changed)
+def drop_media_visibility(sender, **kwargs):
+    media_visibility_cache.invalidate_all()
+
+
+@receiver(post_save, sender=SinglePhoto)
+@receiver(post_delete, sender=SinglePhoto)
+def drop_photo_visibility(sender, instance, **kwargs):
+    media_visibility_cache.invalidate(instance.photo.name)
+
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def drop_cover_visibility(sender, instance, **kwargs):
+    media_visibility_cache.invalidate(instance.cover.name)
+
+
+# image derivatives and placeholders
+@receiver(post_save, sender=SinglePhoto)
+def photo_derivatives(sender, instance, **kwargs):
+    schedule_image_processing(instance.photo, owner_id=instance.owner_id)
+
+
+@receiver(post_save, sender=Collection)
+def cover_derivatives(sender, instance, **kwargs):
+    schedule_image_processing(instance.cover, owner_id=instance.owner_id)
+
+
+@receiver(post_save, sender=User)
+def avatar_derivatives(sender, instance, **kwargs):
+    schedule_image_processing(instance.profile_pic, owner_id=instance.pk)
+
+
+# subscription counters
+def _shift_subscription_counts(subscriptions, delta):
+    """
+    Adds `delta` to the counters of both sides of every (user, subscriber)
+    pair, with one UPDATE per distinct change.
+    """
+    for field, users in (('subscribers_count', Counter(user for user, _ in subscriptions)),
+                         ('subscribed_to_count', Counter(subscriber for _, subscriber in subscriptions))):
+        by_change = {}
+        for pk, count in users.items():
+            by_change.setdefault(count * delta, []).append(pk)
+        for change, pks in by_change.items():
+            # a counter that drifted below the real count stays at zero until reconciled
+            User.objects.filter(pk__in=pks).update(**{field: Greatest(F(field) + change, Value(0))})
+        invalidate_short_infos(users)
+
+
+def _subscriptions(instance, reverse, pk_set=None):
+    rows = User.subscribers.through.objects.filter(**{'to_user' if reverse else 'from_user': instance})
+    if pk_set is not None:
+        rows = rows.filter(**{'from_user__in' if reverse else 'to_user__in': pk_set})
+    return list(rows.values_list('from_user_id', 'to_user_id'))
+
+
+@receiver(m2m_changed, sender=User.subscribers.through)
+def subscriptions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add':
+        # pk_set only holds the subscriptions that didn't exist yet
+        subscriptions = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        _shift_subscription_counts(subscriptions, 1)
+        subscribed(subscriptions)
+    elif action in ('pre_remove', 'pre_clear'):
+        # only the rows that exist are removed
+        instance._removed_subscriptions = _subscriptions(instance, reverse, pk_set)
+    elif action in ('post_remove', 'post_clear'):
+        subscriptions = instance.__dict__.pop('_removed_subscriptions', [])
+        _shift_subscription_counts(subscriptions, -1)
+        unsubscribed(subscriptions)
+
+
+@receiver(pre_delete, sender=User)
+def release_deleted_user_subscriptions(sender, instance, **kwargs):
+    # the rows are deleted by the cascade, which sends no m2m_changed
+    subscriptions = _subscriptions(instance, False) + _subscriptions(instance, True)
+    _shift_subscription_counts(subscriptions, -1)
+
+
+# home timelines
+@receiver(post_save, sender=PhotoSeries)
+def push_created_series(sender, instance, created, **kwargs):
+    if created:
+        schedule_fan_out(instance)
+
+
+# user short info cache
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_user_short_info(sender, instance, **kwargs):
+    invalidate_short_infos([instance.pk])
+
+
+# authenticated user cache
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    invalidate_cached_users([instance.pk])
@@ -0,0 +1,122 @@
+"""
+Content addressed media storage.
+
+Uploads are hashed (SHA-256) while they are streamed to disk and stored once
+under `pictures/ab/cd/<hash><ext>`, whatever name they were uploaded with.
+`MediaBlob` counts the model fields referencing every stored file, so
+deleting an object only removes the file (and its derivatives) when nothing
+else uses it. A reference is taken under the blob row lock before the file
+is written, and a file is only removed after the releasing transaction
+commits, under the same lock and while its count is still zero, so a
+concurrent upload of the same content never ends up with a missing file.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from .models import MediaBlob
+from .thumbnails import derivative_names, original_name
+
+BLOB_DIR = 'pictures'
+TMP_DIR = 'tmp'
+
+
+def blob_name(digest, ext):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext.lower()}'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # the final name is derived from the content in _save
+        return name
+
+    def _save(self, name, content):
+        digest = getattr(content, 'sha256', None)
+        if digest and hasattr(content, 'temporary_file_path'):
+            # hashed and written to MEDIA_ROOT/tmp while it was received, see api.upload_handlers
+            temp_path, owned = content.temporary_file_path(), False
+        else:
+            digest, temp_path = self._stream_to_temp(content)
+            owned = True
+
+        name = blob_name(digest, os.path.splitext(name)[1])
+        full_path = self.path(name)
+        with transaction.atomic():
+            # the row lock taken here keeps a concurrent release from removing the file
+            self._acquire(name)
+            if os.path.exists(full_path):
+                if owned:
+                    os.remove(temp_path)
+            else:
+                self._make_directory(os.path.dirname(full_path))
+                file_move_safe(temp_path, full_path, allow_overwrite=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def delete(self, name):
+        self._release(name)
+
+    def discard_unreferenced(self, names):
+        """
+        Removes the files of `names` that no MediaBlob references, used after a
+        rolled back transaction that saved them. Files shared with committed
+        rows, or referenced by a save still in progress, stay.
+        """
+        for name in set(names):
+            self._remove_unreferenced(name)
+
+    def _stream_to_temp(self, content):
+        temp_dir = self.path(TMP_DIR)
+        self._make_directory(temp_dir)
+        hasher = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        with os.fdopen(fd, 'wb') as temp_file:
+            for chunk in content.chunks():
+                hasher.update(chunk)
+                temp_file.write(chunk)
+        return hasher.hexdigest(), temp_path
+
+    def _make_directory(self, directory):
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+
+    def _acquire(self, name):
+        # waits for a concurrent removal of the file, or for the save that creates the row
+        MediaBlob.objects.select_for_update().get_or_create(name=name, defaults={'refcount': 0})
+        MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+    def _release(self, name):
+        """
+        Drops one reference to `name`. The file is removed after the commit
+        when it was the last one.
+        """
+        blobs = MediaBlob.objects.filter(name=name)
+        if blobs.filter(refcount__gt=1).update(refcount=F('refcount') - 1):
+            return
+        # the last reference, or a file stored before blobs were counted
+        blobs.update(refcount=0)
+        transaction.on_commit(lambda: self._remove_unreferenced(name))
+
+    def _remove_unreferenced(self, name):
+        with transaction.atomic():
+            blob, _ = MediaBlob.objects.select_for_update().get_or_create(name=name, defaults={'refcount': 0})
+            if blob.refcount:
+                # referenced again in the meantime
+                return
+            super().delete(name)
+            if original_name(name) == name:
+                for derivative in derivative_names(name):
+                    super().delete(derivative)
+            blob.delete()
@@ -0,0 +1,129 @@
+"""
+Tag -> series posting lists.
+
+Every tag keeps the sorted ids of its series packed into a uint64 array
+(`TagPostings.series_ids`), wide enough for any BigAutoField id. A multi-tag filter loads all the posting lists in
+one query, intersects (or unites) them in memory and hydrates the matching
+series with a single `pk__in` filter instead of one join per tag. Large id
+sets are sent as one array (Postgres) or JSON (SQLite) parameter.
+"""
+import json
+from array import array
+from bisect import bisect_left
+
+from django.db import transaction
+from django.db.models.expressions import RawSQL
+
+from .models import PhotoSeries, TagPostings
+
+TYPECODE = 'Q'
+# above this many matching ids they are sent as a single parameter instead of one per id
+MAX_INLINE_IDS = 500
+
+
+def _unpack(blob):
+    postings = array(TYPECODE)
+    postings.frombytes(bytes(blob))
+    return postings
+
+
+def _update_postings(tag_ids, series_ids, add):
+    series_ids = sorted(series_ids)
+    if not tag_ids or not series_ids:
+        return
+    with transaction.atomic():
+        existing = TagPostings.objects.select_for_update().in_bulk(tag_ids)
+        changed, created = [], []
+        for tag_id in tag_ids:
+            entry = existing.get(tag_id)
+            is_new = entry is None
+            if is_new:
+                if not add:
+                    continue
+                entry = TagPostings(tag_id=tag_id, series_ids=b'')
+                created.append(entry)
+            postings = _unpack(entry.series_ids)
+            modified = False
+            for series_id in series_ids:
+                i = bisect_left(postings, series_id)
+                found = i < len(postings) and postings[i] == series_id
+                if add and not found:
+                    postings.insert(i, series_id)
+                    modified = True
+                elif not add and found:
+                    del postings[i]
+                    modified = True
+            entry.series_ids = postings.tobytes()
+            # lists that already hold (or lack) the ids are not written again
+            if modified and not is_new:
+                changed.append(entry)
+        TagPostings.objects.bulk_create(created)
+        TagPostings.objects.bulk_update(changed, ['series_ids'])
+
+
+def add_postings(tag_ids, series_ids):
+    _update_postings(list(tag_ids), series_ids, add=True)
+
+
+def remove_postings(tag_ids, series_ids):
+    _update_postings(list(tag_ids), series_ids, add=False)
+
+
+def series_ids_for_tags(tag_ids, match_all=True):
+    """
+    Returns the ids of the series tagged with all (or any) of `tag_ids`.
+    """
+    postings = [_unpack(blob) for blob in TagPostings.objects.filter(tag_id__in=tag_ids)
+                .values_list('series_ids', flat=True)]
+    if match_all:
+        if len(postings) < len(set(tag_ids)):
+            return []
+        postings.sort(key=len)
+        result = set(postings[0])
+        for other in postings[1:]:
+            result.intersection_update(other)
+    else:
+        result = set()
+        for other in postings:
+            result.update(other)
+    return sorted(result)
+
+
+def filter_series_by_tags(queryset, tag_ids, match_all=True):
+    tag_ids = list(set(tag_ids))
+    if len(tag_ids) == 1:
+        return queryset.filter(tag__id=tag_ids[0])
+
+    series_ids = series_ids_for_tags(tag_ids, match_all)
+    if len(series_ids) <= MAX_INLINE_IDS:
+        return queryset.filter(pk__in=series_ids)
+    return queryset.filter(pk__in=_IdList(series_ids))
+
+
+class _IdList(RawSQL):
+    """
+    A subquery yielding `ids`, bound as one parameter so that the size of the
+    list is not limited by the number of query parameters.
+    """
+
+    def __init__(self, ids):
+        self.ids = list(ids)
+        super().__init__('SELECT value FROM json_each(%s)', (json.dumps(self.ids),))
+
+    def as_postgresql(self, compiler, connection):
+        return '(SELECT unnest(%s::bigint[]))', (self.ids,)
+
+
+def rebuild_postings():
+    rows = PhotoSeries.tag.through.objects.order_by('tag_id', 'photoseries_id') \
+        .values_list('tag_id', 'photoseries_id').iterator()
+    entries = {}
+    for tag_id, series_id in rows:
+        entries.setdefault(tag_id, array(TYPECODE)).append(series_id)
+
+    with transaction.atomic():
+        TagPostings.objects.all().delete()
+        TagPostings.objects.bulk_create(
+            TagPostings(tag_id=tag_id, series_ids=postings.tobytes()) for tag_id, postings in entries.items()
+        )
+    return len(entries)
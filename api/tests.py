@@ -1,3 +1,682 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models import TextField
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import register_lookup
+from django.utils import timezone
+from djoser.utils import encode_uid
+from rest_framework.test import APIClient
+
+from . import jobs
+from .media_signing import SIGNATURE_PARAM
+from .models import Collection, Job, MediaBlob, PhotoSeries, SeriesRecommendation, SinglePhoto, Tag, User
+from .recommendations import build_recommendations, load_postings
+from .search import _search_postgres, search_series
+from .storage import ContentAddressedStorage
+from .tag_index import filter_series_by_tags, rebuild_postings, series_ids_for_tags
+from .serializers import SinglePhotoSerializer
+
+
+# any connection attempt, like the former request to our own activation endpoint
+@mock.patch('socket.socket.connect', side_effect=AssertionError('outbound connection'))
+class UserActivationViewTests(TestCase):
+    """
+    The test client runs every request in this one thread, like a single sync
+    worker, so an activation that called back into the server would hang or fail.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user('new', 'new@example.com', 'password', is_active=False)
+
+    def activation_url(self, user, token=None):
+        return f'/activate/{encode_uid(user.pk)}/{token or default_token_generator.make_token(user)}'
+
+    def test_activates_user(self, connect):
+        response = self.client.get(self.activation_url(self.user))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'api/activation.html')
+        self.assertEqual(response.context['result'], 'activated')
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertEqual(mail.outbox[-1].to, ['new@example.com'])
+        connect.assert_not_called()
+
+    def test_used_link(self, connect):
+        url = self.activation_url(self.user)
+        self.client.get(url)
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.context['result'], 'stale')
+
+    def test_invalid_token(self, connect):
+        response = self.client.get(self.activation_url(self.user, token='abc-def'))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.context['result'], 'invalid')
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+
+class SecretSeriesTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.series = PhotoSeries.objects.create(name='secret', description='', owner=self.owner)
+        SinglePhoto.objects.create(series=self.series, owner=self.owner, photo='pictures/secret.png')
+        collection = Collection.objects.create(name='secret', owner=self.owner, is_secret=True)
+        collection.update_series(add=[self.series.pk])
+        self.collection = collection
+        self.client = APIClient()
+
+    def test_anonymous_gets_no_signed_url(self):
+        response = self.client.get(f'/api/post/{self.series.pk}')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn(SIGNATURE_PARAM, response.content.decode())
+
+    def test_anonymous_gets_no_secret_collection(self):
+        response = self.client.get(f'/api/collection/{self.collection.pk}')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn(SIGNATURE_PARAM, response.content.decode())
+
+    def test_owner_gets_signed_urls(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(f'/api/post/{self.series.pk}')
+
+        self.assertEqual(response.status_code, 200)
+        photo = response.data['series_photos'][0]
+        self.assertIn(SIGNATURE_PARAM, photo['photo'])
+        self.assertIn(SIGNATURE_PARAM, photo['photo_srcset']['200']['webp'])
+
+    def test_series_serializer_signs_only_for_the_owner(self):
+        photo = SinglePhoto.objects.select_related('series').get(series=self.series)
+
+        data = SinglePhotoSerializer(photo).data
+
+        self.assertNotIn(SIGNATURE_PARAM, data['photo'])
+        self.assertNotIn(SIGNATURE_PARAM, data['photo_srcset']['600']['jpg'])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.sea = PhotoSeries.objects.create(name='Море', description='закат на побережье', owner=owner)
+        self.cats = PhotoSeries.objects.create(name='Котики', description='спят', owner=owner)
+        self.cats.tag.add(Tag.objects.create(tag='море'))
+
+    def test_inverted_index_ranks_name_above_tags(self):
+        found = search_series(PhotoSeries.objects.all(), 'мор')
+
+        self.assertEqual(list(found), [self.sea, self.cats])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(list(search_series(PhotoSeries.objects.all(), 'котики море')), [self.cats])
+        self.assertFalse(search_series(PhotoSeries.objects.all(), '!!!').exists())
+
+    def test_postgres_query_compiles(self):
+        from django.contrib.postgres.lookups import TrigramSimilar
+        from django.db.backends.postgresql.base import DatabaseWrapper
+
+        postgres = DatabaseWrapper({**connection.settings_dict, 'ENGINE': 'django.db.backends.postgresql'}, 'pg')
+        # registered by django.contrib.postgres, installed with the Postgres engine only
+        with register_lookup(TextField, TrigramSimilar):
+            queryset = _search_postgres(PhotoSeries.objects.all(), 'котики море')
+            sql, params = queryset.query.get_compiler(connection=postgres).as_sql()
+
+        self.assertIn('@@ to_tsquery', sql)
+        self.assertIn('"api_photoseries"."search_document" %% %s', sql)
+        self.assertIn('котики:* & море:*', params)
+
+
+class TagIndexTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.cat, self.sea, self.dog = [Tag.objects.create(tag=name) for name in ('cat', 'sea', 'dog')]
+        self.series = [PhotoSeries.objects.create(name=str(i), description='', owner=owner) for i in range(5)]
+        for series in self.series[:4]:
+            series.tag.add(self.cat)
+        for series in self.series[2:]:
+            series.tag.add(self.sea)
+
+    def filtered(self, tags, match_all):
+        queryset = filter_series_by_tags(PhotoSeries.objects.all(), [tag.pk for tag in tags], match_all)
+        return sorted(series.pk for series in queryset), str(queryset.query)
+
+    def test_and_or_below_inline_cap(self):
+        ids, _ = self.filtered([self.cat, self.sea], match_all=True)
+        self.assertEqual(ids, [self.series[2].pk, self.series[3].pk])
+        ids, _ = self.filtered([self.cat, self.sea], match_all=False)
+        self.assertEqual(ids, [series.pk for series in self.series])
+
+    def test_and_or_above_inline_cap_without_joins(self):
+        with mock.patch('api.tag_index.MAX_INLINE_IDS', 1):
+            ids, sql = self.filtered([self.cat, self.sea], match_all=True)
+            self.assertEqual(ids, [self.series[2].pk, self.series[3].pk])
+            self.assertNotIn('api_photoseries_tag', sql)
+            ids, sql = self.filtered([self.cat, self.sea], match_all=False)
+            self.assertEqual(ids, [series.pk for series in self.series])
+            self.assertNotIn('api_photoseries_tag', sql)
+
+    def test_missing_tag_matches_nothing(self):
+        queryset = filter_series_by_tags(PhotoSeries.objects.all(), [self.cat.pk, self.dog.pk], match_all=True)
+
+        self.assertFalse(queryset.exists())
+
+    def test_postings_follow_tag_changes(self):
+        first, last = self.series[0], self.series[4]
+        first.tag.remove(self.cat)
+        last.tag.add(self.cat, self.dog)
+        self.series[3].tag.clear()
+        self.series[2].delete()
+
+        expected = {self.cat.pk: [self.series[1].pk, last.pk], self.sea.pk: [last.pk], self.dog.pk: [last.pk]}
+        for tag_id, ids in expected.items():
+            self.assertEqual(series_ids_for_tags([tag_id]), ids)
+        rebuild_postings()
+        for tag_id, ids in expected.items():
+            self.assertEqual(series_ids_for_tags([tag_id]), ids)
+
+    def test_64_bit_ids(self):
+        big = PhotoSeries.objects.create(pk=2 ** 33 + 1, name='big', description='', owner=self.series[0].owner)
+        big.tag.add(self.cat)
+
+        self.assertEqual(series_ids_for_tags([self.cat.pk])[-1], 2 ** 33 + 1)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.cat, self.sea, self.dog = [Tag.objects.create(tag=name) for name in ('cat', 'sea', 'dog')]
+        self.both, self.same, self.cats, self.dogs = [self.create(name) for name in ('both', 'same', 'cats', 'dogs')]
+        self.both.tag.add(self.cat, self.sea)
+        self.same.tag.add(self.cat, self.sea)
+        self.cats.tag.add(self.cat)
+        self.dogs.tag.add(self.dog)
+
+    def create(self, name, **kwargs):
+        return PhotoSeries.objects.create(name=name, description='', owner=self.owner, **kwargs)
+
+    def recommended(self, series):
+        return list(SeriesRecommendation.objects.filter(series=series).order_by('rank')
+                    .values_list('recommended_id', 'score'))
+
+    def test_ranked_by_jaccard(self):
+        self.assertEqual(build_recommendations(), 4)
+
+        self.assertEqual(self.recommended(self.both), [(self.same.pk, 1.0), (self.cats.pk, 0.5)])
+        self.assertEqual(self.recommended(self.cats), [(self.same.pk, 0.5), (self.both.pk, 0.5)])
+        self.assertEqual(self.recommended(self.dogs), [])
+        self.assertFalse(PhotoSeries.objects.filter(recommendations_stale=True).exists())
+
+    def test_incremental_build_only_recomputes_stale_series(self):
+        build_recommendations()
+        self.dogs.tag.add(self.cat)
+
+        self.assertEqual(build_recommendations(), 1)
+        self.assertEqual(self.recommended(self.dogs)[0], (self.cats.pk, 0.5))
+
+    def test_hidden_series_are_not_recommended(self):
+        Collection.objects.create(name='secret', owner=self.owner, is_secret=True).update_series(add=[self.same.pk])
+
+        build_recommendations()
+
+        self.assertEqual(self.recommended(self.both), [(self.cats.pk, 0.5)])
+
+    def test_counts_sized_by_series_not_by_ids(self):
+        big = self.create('big', pk=2 ** 33 + 1)
+        big.tag.add(self.cat, self.dog)
+
+        postings, (counted_ids, counts) = load_postings()
+
+        self.assertEqual(postings[self.cat.pk].tolist(), [self.both.pk, self.same.pk, self.cats.pk, big.pk])
+        self.assertEqual(dict(zip(counted_ids.tolist(), counts.tolist()))[big.pk], 2)
+        self.assertEqual(len(counted_ids), 5)
+
+
+class UserShortInfoTests(TestCase):
+    def setUp(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        # file based: shared by all workers, unlike the default LocMemCache
+        shared = override_settings(
+            CACHES={**settings.CACHES, 'shared': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir,
+            }},
+            USER_SHORT_INFO_CACHE_ALIAS='shared',
+        )
+        shared.enable()
+        self.addCleanup(shared.disable)
+        self.addCleanup(caches['shared'].clear)
+        self.users = [User.objects.create_user(f'user{i}', f'user{i}@example.com', 'password') for i in range(3)]
+        self.client = APIClient()
+
+    def batch(self, ids):
+        return self.client.get('/api/user/shortinfo/', {'ids': ','.join(str(pk) for pk in ids)})
+
+    def test_batch_in_order_with_one_query(self):
+        ids = [self.users[2].pk, 10 ** 6, self.users[0].pk]
+        with self.assertNumQueries(1):
+            response = self.batch(ids)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([info['username'] for info in response.data], ['user2', 'user0'])
+        with self.assertNumQueries(1):
+            # only the unknown id is read again
+            self.assertEqual(self.batch(ids).data, response.data)
+
+    def test_saved_user_is_invalidated_after_commit(self):
+        user = self.users[0]
+        self.batch([user.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.username = 'renamed'
+            user.save()
+
+        self.assertEqual(self.batch([user.pk]).data[0]['username'], 'renamed')
+
+    def test_subscription_invalidates_both_sides(self):
+        account, subscriber = self.users[:2]
+        self.batch([account.pk, subscriber.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            account.subscribers.add(subscriber)
+
+        with self.assertNumQueries(1):
+            self.batch([account.pk, subscriber.pk])
+
+    @override_settings(USER_SHORT_INFO_CACHE_ALIAS='default')
+    def test_process_local_cache_is_not_used(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.batch([self.users[0].pk])
+
+    def test_bad_ids(self):
+        self.assertEqual(self.batch(['a']).status_code, 400)
+        self.assertEqual(self.batch([]).status_code, 400)
+        self.assertEqual(self.batch(range(1, 102)).status_code, 400)
+
+
+class RandomFeedTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        PhotoSeries.objects.bulk_create(
+            PhotoSeries(name=str(i), description='', owner=owner, random_rank=i / 25) for i in range(25)
+        )
+        self.client = APIClient()
+
+    def read_feed(self, seed):
+        pages, cursor = [], None
+        with mock.patch('api.pagination.random', return_value=seed):
+            while True:
+                response = self.client.get('/api/photostock/', {'cursor': cursor} if cursor else {})
+                self.assertEqual(response.status_code, 200)
+                pages.append([series['id'] for series in response.data])
+                cursor = response.get('X-Next-Cursor')
+                if not cursor:
+                    return pages
+
+    def test_pages_cover_the_feed_once(self):
+        for seed in (0.0, 0.5, 0.52, 0.99):
+            pages = self.read_feed(seed)
+            ids = [pk for page in pages for pk in page]
+
+            self.assertEqual([len(page) for page in pages], [10, 10, 5])
+            self.assertCountEqual(ids, PhotoSeries.objects.values_list('pk', flat=True))
+
+    def test_order_starts_at_the_seed(self):
+        first = self.read_feed(0.5)[0][0]
+
+        self.assertEqual(PhotoSeries.objects.get(pk=first).random_rank, 0.52)
+
+    def test_bad_cursor(self):
+        for cursor in ('garbage', 'cz0wLjUmcD0wJnI9YWJjJmk9MQ'):
+            self.assertEqual(self.client.get('/api/photostock/', {'cursor': cursor}).status_code, 404)
+
+    def test_backfill_gives_shared_ranks_their_own(self):
+        PhotoSeries.objects.filter(pk__in=PhotoSeries.objects.values('pk')[:20]).update(random_rank=0.5)
+        untouched = dict(PhotoSeries.objects.exclude(random_rank=0.5).values_list('pk', 'random_rank'))
+
+        call_command('backfill_random_rank', stdout=mock.Mock())
+
+        self.assertEqual(PhotoSeries.objects.values('random_rank').distinct().count(), 25)
+        self.assertEqual(dict(PhotoSeries.objects.filter(pk__in=untouched).values_list('pk', 'random_rank')), untouched)
+
+
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = ContentAddressedStorage(location=location)
+
+    def refcount(self, name):
+        return MediaBlob.objects.filter(name=name).values_list('refcount', flat=True).first()
+
+    def test_same_content_is_stored_once(self):
+        first = self.storage.save('a.txt', ContentFile(b'hello'))
+        second = self.storage.save('b.TXT', ContentFile(b'hello'))
+        other = self.storage.save('c.txt', ContentFile(b'world'))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(self.refcount(first), 2)
+        self.assertEqual(self.refcount(other), 1)
+
+    def test_file_removed_with_the_last_reference_after_commit(self):
+        name = self.storage.save('a.txt', ContentFile(b'hello'))
+        self.storage.save('b.txt', ContentFile(b'hello'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.storage.delete(name)
+            self.assertTrue(self.storage.exists(name))
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(self.storage.exists(name))
+        self.assertIsNone(self.refcount(name))
+
+    def test_reference_taken_before_the_commit_keeps_the_file(self):
+        name = self.storage.save('a.txt', ContentFile(b'hello'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.storage.delete(name)
+            self.storage.save('b.txt', ContentFile(b'hello'))
+
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.refcount(name), 1)
+
+    def test_missing_file_is_written_again(self):
+        name = self.storage.save('a.txt', ContentFile(b'hello'))
+        os.remove(self.storage.path(name))
+
+        self.storage.save('b.txt', ContentFile(b'hello'))
+
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.refcount(name), 2)
+
+    def test_discard_unreferenced(self):
+        kept = self.storage.save('a.txt', ContentFile(b'kept'))
+        with transaction.atomic():
+            orphan = self.storage.save('b.txt', ContentFile(b'orphan'))
+            transaction.set_rollback(True)
+
+        self.storage.discard_unreferenced([kept, orphan])
+
+        self.assertTrue(self.storage.exists(kept))
+        self.assertFalse(self.storage.exists(orphan))
+
+
+# jobs run in pool threads with their own connections, which only see committed rows
+class JobQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.calls = []
+        self.failures = {}
+        for kind, max_attempts in (('test_record', 3), ('test_once', 1)):
+            jobs.job(kind, max_attempts=max_attempts)(self.record)
+            self.addCleanup(jobs.handlers.pop, kind)
+
+    def record(self, value):
+        self.calls.append(value)
+        if self.failures.get(value):
+            self.failures[value] -= 1
+            raise RuntimeError(f'failed {value}')
+
+    def make_due(self):
+        Job.objects.filter(status=Job.QUEUED).update(run_after=timezone.now())
+
+    def test_burst_runs_every_queued_job(self):
+        queued = [jobs.enqueue('test_record', value=i) for i in range(5)]
+
+        jobs.work(concurrency=2, burst=True)
+
+        self.assertCountEqual(self.calls, range(5))
+        for job in Job.objects.filter(pk__in=[job.pk for job in queued]):
+            self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+            self.assertIsNotNone(job.finished_at)
+
+    def test_failed_job_is_retried_later(self):
+        self.failures['flaky'] = 1
+        job = jobs.enqueue('test_record', value='flaky')
+
+        jobs.work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn('failed flaky', job.error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        jobs.work(burst=True)
+        self.assertEqual(self.calls, ['flaky'])
+
+        self.make_due()
+        jobs.work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), (Job.DONE, 2, ''))
+
+    def test_job_fails_after_its_last_attempt(self):
+        self.failures['broken'] = 10
+        job = jobs.enqueue('test_once', value='broken')
+
+        jobs.work(burst=True)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertIn('RuntimeError', job.error)
+
+    def test_stale_running_job_is_queued_again(self):
+        job = jobs.enqueue('test_record', value='lost')
+        started = timezone.now() - timedelta(seconds=settings.JOB_LEASE + 1)
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, started_at=started, attempts=F('attempts') + 1)
+
+        self.assertEqual(jobs.requeue_stale(), 1)
+        jobs.work(burst=True)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 2))
+        self.assertEqual(self.calls, ['lost'])
+
+
+class CollectionSeriesTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'owner@example.com', 'password')
+        self.series = [PhotoSeries.objects.create(name=str(i), description='', owner=self.owner) for i in range(4)]
+        self.collection = Collection.objects.create(name='trip', owner=self.owner)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def patch(self, collection=None, **data):
+        return self.client.patch(f'/api/collection/{(collection or self.collection).pk}', data, format='json')
+
+    def ids(self, *indexes):
+        return [self.series[i].pk for i in indexes]
+
+    def test_add_remove_and_reorder(self):
+        response = self.patch(add=self.ids(0, 1, 2))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['collections_series'], self.ids(0, 1, 2))
+
+        response = self.patch(add=self.ids(3), remove=self.ids(1))
+        self.assertEqual(response.data['collections_series'], self.ids(0, 2, 3))
+
+        response = self.patch(order=self.ids(3, 2))
+        self.assertEqual(response.data['collections_series'], self.ids(3, 2, 0))
+
+        # the embedded page follows the same order
+        response = self.client.get(f'/api/collection/{self.collection.pk}')
+        self.assertEqual([series['id'] for series in response.data['collections_series']], self.ids(3, 2, 0))
+
+    def test_series_of_someone_else_is_rejected(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        foreign = PhotoSeries.objects.create(name='foreign', description='', owner=other)
+
+        response = self.patch(add=[self.series[0].pk, foreign.pk])
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.collection.collections_series.exists())
+
+    def test_only_the_owner_may_change_it(self):
+        self.client.force_authenticate(User.objects.create_user('other', 'other@example.com', 'password'))
+
+        self.assertEqual(self.patch(add=self.ids(0)).status_code, 403)
+        self.assertEqual(self.client.patch('/api/collection/0', {'add': [1]}, format='json').status_code, 404)
+
+    def test_empty_request(self):
+        self.assertEqual(self.patch().status_code, 400)
+
+    def test_secret_collection_hides_its_series(self):
+        secret = Collection.objects.create(name='secret', owner=self.owner, is_secret=True)
+
+        self.patch(secret, add=self.ids(0, 1))
+        self.assertEqual(set(PhotoSeries.objects.filter(is_public=False).values_list('pk', flat=True)),
+                         set(self.ids(0, 1)))
+
+        self.patch(secret, remove=self.ids(0))
+        self.assertEqual(list(PhotoSeries.objects.filter(is_public=False).values_list('pk', flat=True)), self.ids(1))
+
+
+class SubscriptionCounterTests(TestCase):
+    def setUp(self):
+        self.account, self.first, self.second = [
+            User.objects.create_user(name, f'{name}@example.com', 'password') for name in ('account', 'first', 'second')
+        ]
+        self.client = APIClient()
+
+    def counters(self, user):
+        user.refresh_from_db()
+        return user.subscribers_count, user.subscribed_to_count
+
+    def subscribe(self, subscriber, account, method='post'):
+        self.client.force_authenticate(subscriber)
+        return getattr(self.client, method)(f'/api/user/subscribe/{account.pk}')
+
+    def test_subscribe_and_unsubscribe(self):
+        self.assertEqual(self.subscribe(self.first, self.account).status_code, 200)
+        self.subscribe(self.second, self.account)
+        # a repeated subscription is not counted twice
+        self.subscribe(self.first, self.account)
+        self.assertEqual(self.counters(self.account), (2, 0))
+        self.assertEqual(self.counters(self.first), (0, 1))
+
+        self.assertEqual(self.subscribe(self.first, self.account, 'delete').status_code, 204)
+        self.subscribe(self.first, self.account, 'delete')
+        self.assertEqual(self.counters(self.account), (1, 0))
+        self.assertEqual(self.counters(self.first), (0, 0))
+        self.assertEqual(self.counters(self.second), (0, 1))
+
+    def test_bulk_changes_from_both_sides(self):
+        self.account.subscribers.add(self.first, self.second)
+        self.first.subscribed_to.add(self.second)
+        self.assertEqual(self.counters(self.account), (2, 0))
+        self.assertEqual(self.counters(self.first), (0, 2))
+        self.assertEqual(self.counters(self.second), (1, 1))
+
+        self.account.subscribers.clear()
+        self.assertEqual(self.counters(self.account), (0, 0))
+        self.assertEqual(self.counters(self.first), (0, 1))
+
+    def test_deleted_user_releases_both_sides(self):
+        self.account.subscribers.add(self.first)
+        self.first.subscribers.add(self.second)
+
+        self.first.delete()
+
+        self.assertEqual(self.counters(self.account), (0, 0))
+        self.assertEqual(self.counters(self.second), (0, 0))
+
+    def test_subscribing_to_yourself(self):
+        self.assertEqual(self.subscribe(self.first, self.first).status_code, 403)
+        self.assertEqual(self.counters(self.first), (0, 0))
+
+    def test_reconcile_fixes_drift(self):
+        self.account.subscribers.add(self.first)
+        User.objects.filter(pk=self.account.pk).update(subscribers_count=7)
+
+        call_command('reconcile_subscription_counts', stdout=mock.Mock())
+
+        self.assertEqual(self.counters(self.account), (1, 0))
+
+
+@override_settings(TIMELINE_FANOUT_LIMIT=2, TIMELINE_BACKFILL=3)
+class TimelineTests(TestCase):
+    def setUp(self):
+        self.account, self.reader, self.other, self.third = [
+            User.objects.create_user(name, f'{name}@example.com', 'password')
+            for name in ('account', 'reader', 'other', 'third')
+        ]
+        self.account.subscribers.add(self.reader)
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def post(self, name, user=None):
+        series = PhotoSeries.objects.create(name=name, description='', owner=user or self.account)
+        # run the fan out jobs here, the pool threads of jobs.work wouldn't see this transaction
+        for job in Job.objects.filter(status=Job.QUEUED):
+            jobs.handlers[job.kind].func(**job.payload)
+            job.delete()
+        return series
+
+    def timeline(self):
+        names, cursor = [], None
+        while True:
+            response = self.client.get('/api/timeline/', {'cursor': cursor} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            names += [series['name'] for series in response.data]
+            cursor = response.get('X-Next-Cursor')
+            if not cursor:
+                return names
+
+    def test_new_series_is_pushed_to_subscribers(self):
+        series = self.post('first')
+
+        self.assertEqual(self.timeline(), ['first'])
+        self.assertFalse(series.is_pulled)
+        self.assertEqual(self.reader.timeline.count(), 1)
+
+    def test_subscribing_backfills_and_unsubscribing_removes(self):
+        for i in range(5):
+            self.post(f'old{i}', user=self.other)
+
+        self.other.subscribers.add(self.reader)
+        self.assertEqual(self.timeline(), ['old4', 'old3', 'old2'])
+
+        self.other.subscribers.remove(self.reader)
+        self.assertEqual(self.timeline(), [])
+
+    def test_series_of_big_accounts_stay_visible_when_they_shrink(self):
+        self.post('pushed')
+        self.account.subscribers.add(self.other, self.third)
+        pulled = self.post('pulled')
+        self.assertTrue(pulled.is_pulled)
+        self.assertEqual(self.timeline(), ['pulled', 'pushed'])
+
+        self.account.subscribers.remove(self.third)
+        self.post('pushed again')
+
+        self.assertEqual(self.timeline(), ['pushed again', 'pulled', 'pushed'])
+
+    def test_paging_without_duplicates(self):
+        for i in range(25):
+            self.post(f's{i:02}')
+
+        self.assertEqual(self.timeline(), [f's{i:02}' for i in reversed(range(25))])
+
+    def test_hidden_series_are_filtered(self):
+        series = self.post('secret')
+        Collection.objects.create(name='secret', owner=self.account, is_secret=True).update_series(add=[series.pk])
+
+        self.assertEqual(self.timeline(), [])
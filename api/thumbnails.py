@@ -0,0 +1,132 @@
+"""
+Fixed width WebP/JPEG derivatives of uploaded images.
+
+Derivatives are stored next to the original as `<name>.<width>w.<ext>` and
+rendered by a background job (api.jobs) queued with the upload, so a large
+image never holds a request worker while Pillow resizes it. The same job
+renders the placeholders of the images (api.placeholders) and writes them
+back to their rows. Derivatives are deleted along with their original by
+api.storage.
+"""
+import os
+import re
+
+from django.apps import apps
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .fields import read_image_metadata
+from .jobs import enqueue, job
+from .placeholders import render_placeholders
+
+WIDTHS = (200, 600, 1200)
+FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+QUALITY = 82
+
+DERIVATIVE_RE = re.compile(r'^(?P<name>.+)\.(?P<width>\d+)w\.(?P<ext>webp|jpg)$')
+
+
+def derivative_name(name, width, ext):
+    return f'{name}.{width}w.{ext}'
+
+
+def derivative_names(name):
+    return [derivative_name(name, width, ext) for width in WIDTHS for ext in FORMATS]
+
+
+def original_name(path):
+    """
+    Maps a derivative path back to the path of its original image.
+    """
+    match = DERIVATIVE_RE.match(path)
+    return match.group('name') if match else path
+
+
+def render_derivatives(path):
+    """
+    Writes every derivative of the image file at `path`.
+    """
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        for width in WIDTHS:
+            resized = image.copy()
+            # never upscale, small originals get same-sized derivatives
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            for ext, image_format in FORMATS.items():
+                if image_format == 'JPEG' and resized.mode != 'RGB':
+                    output = resized.convert('RGB')
+                elif image_format == 'WEBP' and resized.mode not in ('RGB', 'RGBA'):
+                    output = resized.convert('RGBA')
+                else:
+                    output = resized
+                target = derivative_name(path, width, ext)
+                output.save(f'{target}.tmp', format=image_format, quality=QUALITY)
+                os.replace(f'{target}.tmp', target)
+
+
+def _fill_metadata(model, field, lookup):
+    # normally read when the file was assigned, see api.fields.MeasuredImageField
+    if model._default_manager.filter(**lookup, **{f'{field.width_field}__isnull': True}).exists():
+        with field.storage.open(lookup[field.attname]) as file:
+            metadata = read_image_metadata(file)
+        model._default_manager.filter(**lookup).update(**dict(zip(field.metadata_fields, metadata)))
+
+
+@job('process_images', concurrency=settings.THUMBNAIL_WORKERS)
+def process_images(images):
+    """
+    Renders the derivatives and the placeholders of the uploaded `images`,
+    [{"model", "pk", "field", "name"}], and fills missing metadata. The
+    placeholders of all images are computed in one batch.
+    """
+    pending = []
+    for image in images:
+        model = apps.get_model(image['model'])
+        field = model._meta.get_field(image['field'])
+        # the lookup includes the file name, a file replaced meanwhile is left to its own job
+        lookup = {'pk': image['pk'], field.attname: image['name']}
+        if not model._default_manager.filter(**lookup).exists():
+            continue
+        if not field.storage.exists(derivative_names(image['name'])[0]):
+            render_derivatives(field.storage.path(image['name']))
+        if getattr(field, 'metadata_fields', None):
+            _fill_metadata(model, field, lookup)
+        if all(getattr(field, 'placeholder_fields', (None, None))):
+            pending.append((model, field, lookup))
+
+    placeholders = render_placeholders([field.storage.path(lookup[field.attname]) for _, field, lookup in pending])
+    for (model, field, lookup), placeholder in zip(pending, placeholders):
+        if placeholder is not None:
+            model._default_manager.filter(**lookup).update(**dict(zip(field.placeholder_fields, placeholder)))
+
+
+def _needs_processing(field_file):
+    if not field_file or not field_file.storage.exists(field_file.name):
+        return False
+    if not field_file.storage.exists(derivative_names(field_file.name)[0]):
+        return True
+    fields = getattr(field_file.field, 'placeholder_fields', (None, None))
+    return all(fields) and not getattr(field_file.instance, fields[0])
+
+
+def schedule_image_processing(*field_files, owner_id=None):
+    """
+    Queues one process_images job for the saved `field_files` that still lack
+    derivatives or a placeholder. Returns the job, or None when there is
+    nothing to do.
+    """
+    images = [
+        {
+            'model': field_file.instance._meta.label_lower,
+            'pk': field_file.instance.pk,
+            'field': field_file.field.name,
+            'name': field_file.name,
+        }
+        for field_file in field_files if _needs_processing(field_file)
+    ]
+    if not images:
+        return None
+    return enqueue('process_images', owner_id=owner_id, images=images)
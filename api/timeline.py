@@ -0,0 +1,103 @@
+"""
+Home timelines: the latest series of the accounts a user is subscribed to.
+
+A new series is pushed into a `TimelineEntry` row per subscriber of its
+owner by a background job (api.jobs), in batches, so reading a timeline is a
+single range scan of the (user, created_at) index. Series of accounts with
+more than TIMELINE_FANOUT_LIMIT subscribers are not pushed: they are marked
+`is_pulled` when created, read from a partial (owner, created_at) index of
+PhotoSeries on request and merged into the page. The mark is kept when the
+account drops back under the limit, so no series falls between the two.
+Series hidden by a secret collection are filtered out when read.
+"""
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import OuterRef, Q, Subquery
+
+from .jobs import enqueue, job
+from .models import PhotoSeries, TimelineEntry, User
+
+
+def is_fanned_out(subscribers_count):
+    return subscribers_count <= settings.TIMELINE_FANOUT_LIMIT
+
+
+@job('fan_out_series')
+def fan_out_series(series_id):
+    series = PhotoSeries.objects.filter(pk=series_id).values('owner_id', 'created_at').first()
+    if series is None:
+        return
+    subscriptions = User.subscribers.through.objects.filter(from_user_id=series['owner_id'])
+    last_pk = 0
+    while True:
+        batch = list(subscriptions.filter(pk__gt=last_pk).order_by('pk')
+                     .values_list('pk', 'to_user_id')[:settings.TIMELINE_BATCH_SIZE])
+        if not batch:
+            return
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user_id=user_id, series_id=series_id, created_at=series['created_at'])
+            for _, user_id in batch
+        ], ignore_conflicts=True)
+        last_pk = batch[-1][0]
+
+
+def schedule_fan_out(series):
+    """
+    Queues the push of a new series into the timelines of its owner's
+    subscribers. Returns the Job, or None when nothing is pushed.
+    """
+    subscribers_count = User.objects.filter(pk=series.owner_id).values_list('subscribers_count', flat=True).first()
+    if not subscribers_count:
+        return None
+    if not is_fanned_out(subscribers_count):
+        PhotoSeries.objects.filter(pk=series.pk).update(is_pulled=True)
+        series.is_pulled = True
+        return None
+    return enqueue('fan_out_series', owner_id=series.owner_id, series_id=series.pk)
+
+
+def subscribed(subscriptions):
+    """
+    Copies the latest series of the accounts into the timelines of their new
+    subscribers, for (account, subscriber) pairs. Pulled series are left out,
+    they are read on request.
+    """
+    pushed = PhotoSeries.objects.filter(is_pulled=False)
+    latest = pushed.filter(owner_id=OuterRef('owner_id')).order_by('-created_at', '-pk') \
+        .values('pk')[:settings.TIMELINE_BACKFILL]
+    series = {}
+    for owner_id, pk, created_at in pushed.filter(owner_id__in={account_id for account_id, _ in subscriptions},
+                                                  pk__in=Subquery(latest)) \
+            .values_list('owner_id', 'pk', 'created_at'):
+        series.setdefault(owner_id, []).append((pk, created_at))
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user_id=user_id, series_id=pk, created_at=created_at)
+        for account_id, user_id in subscriptions
+        for pk, created_at in series.get(account_id, ())
+    ], ignore_conflicts=True)
+
+
+def unsubscribed(subscriptions):
+    for account_id, user_id in subscriptions:
+        TimelineEntry.objects.filter(user_id=user_id, series__owner_id=account_id).delete()
+
+
+def read_timeline(user, after=None, limit=20):
+    """
+    Returns up to `limit` (created_at, series id) pairs of the timeline of
+    `user`, newest first, that come after the pair `after`.
+    """
+    entries = TimelineEntry.objects.filter(user=user, series__is_public=True)
+    # series of accounts too big to be pushed are read on request
+    pulled = PhotoSeries.objects.filter(owner__in=user.subscribed_to.values('pk'), is_pulled=True, is_public=True)
+    if after is not None:
+        created_at, pk = after
+        entries = entries.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, series_id__lt=pk))
+        pulled = pulled.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    pushed = entries.order_by('-created_at', '-series_id').values_list('created_at', 'series_id')[:limit]
+    pulled = pulled.order_by('-created_at', '-pk').values_list('created_at', 'pk')[:limit]
+    # a series is either pushed or pulled, never both
+    return list(islice(heapq.merge(pushed, pulled, reverse=True), limit))
@@ -0,0 +1,141 @@
+"""
+Memory bounded handling of uploaded images.
+
+`StreamingImageUploadHandler` writes every uploaded file straight to a
+temporary file under MEDIA_ROOT/tmp while hashing it, so
+api.storage.ContentAddressedStorage can move it into place without reading
+it again. The first bytes of a file are checked against the PNG, JPEG and
+GIF signatures and its header is parsed incrementally for the image size,
+so other files and decompression bombs are rejected before the rest of the
+body is read. Byte caps apply per file and per request.
+"""
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from PIL import Image
+from rest_framework import status
+from rest_framework.exceptions import APIException, UnsupportedMediaType
+
+from .storage import TMP_DIR
+
+SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+    b'\xff\xd8\xff': 'image/jpeg',
+    b'GIF87a': 'image/gif',
+    b'GIF89a': 'image/gif',
+}
+SIGNATURE_LENGTH = max(len(signature) for signature in SIGNATURES)
+# JPEG headers can follow a large EXIF block, bigger headers are left to Pillow later
+MAX_HEADER_SIZE = 512 * 1024
+
+
+class PayloadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload is too large.'
+    default_code = 'payload_too_large'
+
+
+def sniff_image_type(head):
+    """
+    Returns the content type of the image starting with the bytes `head`,
+    or None when it isn't a PNG, JPEG or GIF.
+    """
+    for signature, content_type in SIGNATURES.items():
+        if head.startswith(signature):
+            return content_type
+    return None
+
+
+class HashedTemporaryUploadedFile(TemporaryUploadedFile):
+    # a TemporaryUploadedFile next to the media files, with the SHA-256 of its content
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        temp_dir = os.path.join(settings.MEDIA_ROOT, TMP_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + os.path.splitext(name)[1], dir=temp_dir)
+        super(TemporaryUploadedFile, self).__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = None
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.request_bytes = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > settings.UPLOAD_MAX_REQUEST_SIZE:
+            raise PayloadTooLarge(f'Uploads are limited to {settings.UPLOAD_MAX_REQUEST_SIZE} bytes per request.')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = HashedTemporaryUploadedFile(self.file_name, self.content_type, 0, self.charset,
+                                                self.content_type_extra)
+        self.hasher = hashlib.sha256()
+        # the start of the file, kept until the image size could be read from it
+        self.header = b''
+        self.header_checked = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.request_bytes += len(raw_data)
+        if start + len(raw_data) > settings.UPLOAD_MAX_FILE_SIZE:
+            self.reject(PayloadTooLarge(f'Files are limited to {settings.UPLOAD_MAX_FILE_SIZE} bytes.'))
+        if self.request_bytes > settings.UPLOAD_MAX_REQUEST_SIZE:
+            self.reject(PayloadTooLarge(f'Uploads are limited to {settings.UPLOAD_MAX_REQUEST_SIZE} bytes per request.'))
+        if not self.header_checked:
+            self.check_header(raw_data)
+
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def check_header(self, raw_data):
+        self.header += raw_data
+        if len(self.header) < SIGNATURE_LENGTH:
+            return
+        content_type = sniff_image_type(self.header)
+        if content_type is None:
+            self.reject(UnsupportedMediaType(self.content_type, 'Only png, jpg and gif images are accepted.'))
+        self.file.content_type = content_type
+
+        # Image.open only parses the header, the pixels are never decoded here
+        try:
+            with Image.open(BytesIO(self.header)) as image:
+                pixels = image.width * image.height
+        except Image.DecompressionBombError:
+            self.reject(PayloadTooLarge('The image has too many pixels.'))
+        except (OSError, SyntaxError, ValueError):
+            # the header continues in the next chunk
+            if len(self.header) > MAX_HEADER_SIZE:
+                self.header, self.header_checked = b'', True
+            return
+        if pixels > Image.MAX_IMAGE_PIXELS:
+            self.reject(PayloadTooLarge('The image has too many pixels.'))
+        self.header, self.header_checked = b'', True
+
+    def file_complete(self, file_size):
+        if file_size < SIGNATURE_LENGTH:
+            self.reject(UnsupportedMediaType(self.content_type, 'Only png, jpg and gif images are accepted.'))
+        self.header = b''
+        self.file.seek(0)
+        self.file.size = file_size
+        self.file.sha256 = self.hasher.hexdigest()
+        return self.file
+
+    def reject(self, exc):
+        self.header = b''
+        self.file.close()
+        raise exc
+
+
+class StreamingUploadMixin:
+    """
+    Parses the multipart bodies of an APIView with StreamingImageUploadHandler.
+    """
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [StreamingImageUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
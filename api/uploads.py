@@ -0,0 +1,125 @@
+"""
+Resumable chunked uploads of photo series.
+
+A client starts an `UploadSession` with the series fields and the names and
+sizes of its files, PUTs every file as consecutive byte ranges and finally
+turns the session into a PhotoSeries. Chunks are appended to
+`<MEDIA_ROOT>/tmp/uploads/<session>/<index>.part` straight from the request
+stream, so memory use doesn't depend on the chunk size, and the size of a
+part file is the offset the client resumes from after a disconnect. A chunk
+that is cut short or fails its SHA-256 checksum is truncated away, and the
+first chunk of a file must start with a PNG, JPEG or GIF signature.
+"""
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, UnsupportedMediaType, ValidationError
+
+from .models import UploadSession
+from .storage import TMP_DIR
+from .upload_handlers import SIGNATURE_LENGTH, sniff_image_type
+
+UPLOADS_DIR = 'uploads'
+READ_SIZE = 64 * 1024
+CHECKSUM_HEADER = 'HTTP_X_CHUNK_SHA256'
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The upload is not in the expected state.'
+    default_code = 'upload_conflict'
+
+
+def uploads_root():
+    return os.path.join(settings.MEDIA_ROOT, TMP_DIR, UPLOADS_DIR)
+
+
+def session_dir(session_id):
+    return os.path.join(uploads_root(), str(session_id))
+
+
+def part_path(session, index):
+    return os.path.join(session_dir(session.pk), f'{index}.part')
+
+
+def received_bytes(session, index):
+    try:
+        return os.path.getsize(part_path(session, index))
+    except FileNotFoundError:
+        return 0
+
+
+def incomplete_files(session):
+    return [
+        index for index, file in enumerate(session.files)
+        if received_bytes(session, index) != file['size']
+    ]
+
+
+def parse_content_range(header):
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise ValidationError('Content-Range must look like "bytes <start>-<end>/<size>".')
+    start, end, total = map(int, match.groups())
+    if start > end or end >= total:
+        raise ValidationError('Content-Range is out of bounds.')
+    return start, end, total
+
+
+def append_chunk(session, index, stream, content_range, checksum):
+    """
+    Appends the chunk read from `stream` to the part file of the file
+    `index` and returns the new offset. The chunk must start exactly at the
+    bytes received so far.
+    """
+    start, end, total = parse_content_range(content_range)
+    if total != session.files[index]['size']:
+        raise ValidationError('Content-Range size differs from the size the session was started with.')
+    if not checksum:
+        raise ValidationError('X-Chunk-SHA256 header is required.')
+
+    os.makedirs(session_dir(session.pk), exist_ok=True)
+    with open(part_path(session, index), 'ab') as part:
+        try:
+            fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadConflict('Another chunk of this file is being uploaded.')
+        offset = os.fstat(part.fileno()).st_size
+        if start != offset:
+            raise UploadConflict({'detail': 'The chunk must start at the received offset.', 'offset': offset})
+
+        hasher = hashlib.sha256()
+        head = b''
+        remaining = end - start + 1
+        try:
+            while remaining and stream is not None:
+                chunk = stream.read(min(READ_SIZE, remaining))
+                if not chunk:
+                    break
+                if start == 0 and len(head) < SIGNATURE_LENGTH:
+                    head += chunk[:SIGNATURE_LENGTH]
+                hasher.update(chunk)
+                part.write(chunk)
+                remaining -= len(chunk)
+            if remaining or hasher.hexdigest() != checksum.lower():
+                raise ValidationError('The chunk is incomplete or its checksum does not match.')
+            if start == 0 and sniff_image_type(head) is None:
+                raise UnsupportedMediaType(None, 'Only png, jpg and gif images are accepted, '
+                                                 'the first chunk must hold the image signature.')
+        except BaseException:
+            part.truncate(offset)
+            raise
+
+    UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+    return end + 1
+
+
+def discard_session_files(session_id):
+    shutil.rmtree(session_dir(session_id), ignore_errors=True)
@@ -2,7 +2,9 @@ from django.urls import path, include
 
 from api.views import PhotoSeriesView, TagView, TagListView, PhotoSeriesMainPageView, NotificationView, CollectionView, \
     Hello, PhotoSeriesCreateView, CollectionCreateView, UserPhotoSeries, UserCollections, UserSubscribeView, \
-    UserSubscribersView, UserShortInfo
+    UserSubscribersView, UserShortInfo, MediaCacheStatsView, UploadSessionCreateView, UploadSessionView, \
+    UploadChunkView, UploadSessionFinalizeView, JobView, TimelineView, UserSubscribersListView, UserFollowingListView, \
+    UserShortInfoBatch
 
 auth_urls = [
     path('auth/', include('djoser.urls')),
@@ -20,6 +22,12 @@ urlpatterns = [
     path('post/', PhotoSeriesCreateView.as_view()),
     #path('post/', view),
     path('photostock/', PhotoSeriesMainPageView.as_view()),
+    path('timeline/', TimelineView.as_view()),
+
+    path('upload/', UploadSessionCreateView.as_view()),
+    path('upload/<uuid:pk>', UploadSessionView.as_view()),
+    path('upload/<uuid:pk>/<int:index>', UploadChunkView.as_view()),
+    path('upload/<uuid:pk>/finalize', UploadSessionFinalizeView.as_view()),
 
     path('collection/<int:pk>', CollectionView.as_view()),
     path('collection/', CollectionCreateView.as_view()),
@@ -28,7 +36,14 @@ urlpatterns = [
     path('usercollections/<int:user_pk>', UserCollections.as_view()),
     path('user/subscribe/<int:user_pk>', UserSubscribeView.as_view()),
     path('user/subscribers/<int:user_pk>', UserSubscribersView.as_view()),
+    path('user/subscribers/<int:user_pk>/list', UserSubscribersListView.as_view()),
+    path('user/following/<int:user_pk>/list', UserFollowingListView.as_view()),
     path('user/shortinfo/<int:user_pk>', UserShortInfo.as_view()),
+    path('user/shortinfo/', UserShortInfoBatch.as_view()),
+
+    path('media/cache/stats/', MediaCacheStatsView.as_view()),
+
+    path('jobs/<int:pk>', JobView.as_view()),
 
     path('notification/', NotificationView.as_view()),
     path('', Hello.as_view())
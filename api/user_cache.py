@@ -0,0 +1,52 @@
+"""
+Cache of serialized UserShortSerializer payloads, one entry per user.
+
+Feed pages resolve all their authors at once: the entries are read with one
+get_many and the missing users with one IN query. Entries are deleted by
+api.signals when a user is saved or deleted or their subscription counters
+change. The payloads hold signed media urls, so they expire well before
+the urls do (USER_SHORT_INFO_CACHE_TIMEOUT < MEDIA_URL_SIGNATURE_TTL).
+Without a cache shared by all workers the users are read from the database.
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .caches import shared_cache
+from .models import User
+from .serializers import UserShortSerializer
+
+KEY_PREFIX = 'user_short_info'
+
+
+def _key(pk):
+    return f'{KEY_PREFIX}:{pk}'
+
+
+def get_short_infos(ids):
+    """
+    Returns {id: UserShortSerializer data} for the users of `ids` that exist.
+    """
+    cache = shared_cache(settings.USER_SHORT_INFO_CACHE_ALIAS)
+    keys = {_key(pk): pk for pk in ids}
+    found = cache.get_many(keys) if cache is not None else {}
+    infos = {keys[key]: data for key, data in found.items()}
+
+    missing = [pk for pk in ids if pk not in infos]
+    if missing:
+        loaded = {
+            user.pk: UserShortSerializer(user).data
+            for user in User.objects.filter(pk__in=missing)
+        }
+        if cache is not None:
+            cache.set_many({_key(pk): data for pk, data in loaded.items()}, settings.USER_SHORT_INFO_CACHE_TIMEOUT)
+        infos.update(loaded)
+    return infos
+
+
+def invalidate_short_infos(ids):
+    cache = shared_cache(settings.USER_SHORT_INFO_CACHE_ALIAS)
+    if cache is None:
+        return
+    keys = [_key(pk) for pk in ids]
+    # after the commit, so a concurrent read can't cache the old row again
+    transaction.on_commit(lambda: cache.delete_many(keys))
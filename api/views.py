@@ -1,27 +1,41 @@
-from random import sample, shuffle, choice, randint
-
+from django.core.files import File
+from django.db import transaction
 from django.http import HttpResponse, Http404, JsonResponse
 from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
 from django.shortcuts import render
+from django.utils.dateparse import parse_datetime
 from django.views import View
+from djoser import signals as djoser_signals
+from djoser.compat import get_user_email
+from djoser.conf import settings as djoser_settings
 from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import status
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
 from rest_framework.parsers import FormParser, MultiPartParser
-from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
 from rest_framework.views import APIView
 
-from .models import Tag, PhotoSeries, Collection
-from .permissions import IsOwnerOrStuff, IsNotSecret
+from .media_cache import media_visibility_cache
+from .models import Tag, PhotoSeries, Collection, CollectionSeries, UploadSession, Job, Subscription
+from .pagination import RandomFeedPagination, SubscriptionPagination, decode_cursor, encode_cursor
+from .search import search_series
+from .storage import TMP_DIR
+from .tag_index import filter_series_by_tags
+from .timeline import read_timeline
+from .upload_handlers import StreamingUploadMixin
+from .user_cache import get_short_infos
+from .permissions import IsOwnerOrStuff, IsNotSecret, HasValidMediaSignature
 from .serializers import PhotoSeriesRetrieveSerializer, TagSerializer, PhotoSeriesShortSerializer, \
-    CollectionRetrieveSerializer, \
-    PhotoSeriesSerializer, CollectionSerializer, UserShortSerializer
+    CollectionRetrieveSerializer, CollectionSeriesUpdateSerializer, \
+    PhotoSeriesSerializer, CollectionSerializer, UserShortSerializer, UploadSessionSerializer, JobSerializer
+from .uploads import CHECKSUM_HEADER, UploadConflict, append_chunk, discard_session_files, incomplete_files, \
+    part_path
 
-import requests
 
 User = get_user_model()
 
@@ -56,7 +70,12 @@ class Hello(APIView):
 
 # Media view tunnel
 class MediaAccess(APIView):
-    permission_classes = [IsOwnerOrStuff | IsNotSecret]
+    # signed urls are checked first and need neither the user nor the database
+    permission_classes = [HasValidMediaSignature | IsOwnerOrStuff | IsNotSecret]
+
+    def perform_authentication(self, request):
+        # authenticate lazily, only unsigned legacy urls look at request.user
+        pass
 
     @swagger_auto_schema(
         operation_description="Возвращает фотографию по защищенному пути",
@@ -64,6 +83,9 @@ class MediaAccess(APIView):
         tags=['Media']
     )
     def get(self, request, format=None, path=None):
+        if path.startswith(f'{TMP_DIR}/'):
+            # files being uploaded, see api.storage and api.uploads
+            raise Http404
         response = HttpResponse()
         print(path)
         del response['Content-Type']
@@ -71,13 +93,38 @@ class MediaAccess(APIView):
         return response
 
 
+class MediaCacheStatsView(APIView):
+    permission_classes = [IsAdminUser, ]
+
+    @swagger_auto_schema(
+        operation_description="Возвращает счетчики кэша видимости медиафайлов, общие для всех воркеров. "
+                              "Без общего кэша (shared=false) кэш выключен и счетчики не ведутся",
+        operation_summary="Кэш видимости медиа",
+        tags=['Media'],
+        responses={
+            200: openapi.Schema(
+                'Счетчики кэша',
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    "hits": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "misses": openapi.Schema(type=openapi.TYPE_INTEGER),
+                    "shared": openapi.Schema(type=openapi.TYPE_BOOLEAN),
+                }
+            ),
+            403: 'Доступ запрещен',
+        }
+    )
+    def get(self, request, format=None):
+        return Response(media_visibility_cache.stats())
+
+
 # PhotoSeries views
 class PhotoSeriesView(APIView):
     permission_classes = [IsOwnerOrStuff | IsNotSecret]
 
     @swagger_auto_schema(
         operation_description="Возвращает серию фото по её id, если запрос без параметров запроса, с параметрами "
-                              "возвращает рекомендации по данному посту(берется 1 рандомный тег)",
+                              "возвращает рекомендации по данному посту(серии с наиболее похожими тегами)",
         operation_summary="Серия фото",
         tags=['PhotoSeries'],
         manual_parameters=[
@@ -115,35 +162,32 @@ class PhotoSeriesView(APIView):
     )
     def get(self, request, pk, format=None):
         try:
-            photo_series = PhotoSeries.objects.get(pk=pk)
-            serializer = PhotoSeriesRetrieveSerializer(photo_series)
+            photo_series = PhotoSeriesRetrieveSerializer.setup_eager_loading(PhotoSeries.objects.all()).get(pk=pk)
+            serializer = PhotoSeriesRetrieveSerializer(photo_series, context={'request': request})
         except Exception as e:
             raise Http404
+        if photo_series.is_secret() and not (request.user.pk == photo_series.owner_id or request.user.is_staff):
+            # series in a secret collection are only shown to their owner
+            raise Http404
         if not request.query_params:
             return Response(serializer.data, status=status.HTTP_200_OK) # single post
         else:
-            related_tags = list(photo_series.tag.all())
-            if related_tags:
-                series = list(
-                    PhotoSeries.objects.filter(
-                        Q(
-                            Q(collection__is_secret=False) | Q(collection__isnull=True)
-                        ) & Q(tag=choice(related_tags))
-                    )
-                )
-            else:
-                series = list(
-                    PhotoSeries.objects.filter(
-                        Q(collection__is_secret=False) | Q(collection__isnull=True)
-                    )
-                )
-
             paginator = LimitOffsetPagination()
             paginator.default_limit = 5
+            limit = paginator.get_limit(request)
+            offset = paginator.get_offset(request)
+
+            # precomputed by api.recommendations
+            recommended = PhotoSeries.objects.public() \
+                .filter(recommended_for__series=photo_series) \
+                .order_by('recommended_for__rank')
+            result_page = list(PhotoSeriesShortSerializer.setup_eager_loading(recommended)[offset:offset + limit])
 
-            random_items = sample(series, min(paginator.default_limit, len(series)))
+            if not result_page and not offset:
+                # not computed yet or the series has no tags
+                random_series = PhotoSeries.objects.public().exclude(pk=pk)
+                result_page = PhotoSeriesShortSerializer.setup_eager_loading(random_series).sample(limit)
 
-            result_page = paginator.paginate_queryset(random_items, request)
             serializer = PhotoSeriesShortSerializer(result_page, many=True)
             return Response(serializer.data, status=status.HTTP_207_MULTI_STATUS) # recommendations for post
 
@@ -179,7 +223,7 @@ class PhotoSeriesView(APIView):
             return Response(status=status.HTTP_403_FORBIDDEN)
 
 
-class PhotoSeriesCreateView(APIView):
+class PhotoSeriesCreateView(StreamingUploadMixin, APIView):
     permission_classes = [IsAuthenticated, ]
     # parser_classes = (MultiPartParser, FormParser)
 
@@ -242,17 +286,179 @@ class PhotoSeriesCreateView(APIView):
         # return Response(status=status.HTTP_200_OK)
 
 
+class UploadSessionCreateView(APIView):
+    permission_classes = [IsAuthenticated, ]
+
+    @swagger_auto_schema(
+        operation_description="Начинает загрузку серии фото по частям. Файлы затем загружаются PUT запросами "
+                              "на /api/upload/<id>/<index> и сессия завершается POST запросом на "
+                              "/api/upload/<id>/finalize",
+        operation_summary="Загрузка серии фото по частям",
+        tags=['Upload'],
+        request_body=UploadSessionSerializer,
+        responses={
+            201: UploadSessionSerializer,
+            400: 'Плохой запрос'
+        }
+    )
+    def post(self, request, format=None):
+        serializer = UploadSessionSerializer(data=request.data, context={'request': request, })
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class UploadSessionMixin:
+    def get_session(self, request, pk):
+        try:
+            return UploadSession.objects.get(pk=pk, owner=request.user)
+        except UploadSession.DoesNotExist:
+            raise Http404
+
+
+class UploadSessionView(UploadSessionMixin, APIView):
+    permission_classes = [IsAuthenticated, ]
+
+    @swagger_auto_schema(
+        operation_description="Возвращает сессию загрузки и число полученных байт каждого файла, "
+                              "с которого продолжается загрузка после обрыва",
+        operation_summary="Сессия загрузки",
+        tags=['Upload'],
+        responses={
+            200: UploadSessionSerializer,
+            404: 'Сессия не найдена'
+        }
+    )
+    def get(self, request, pk, format=None):
+        session = self.get_session(request, pk)
+        return Response(UploadSessionSerializer(session, context={'request': request, }).data)
+
+    @swagger_auto_schema(
+        operation_description="Отменяет загрузку и удаляет полученные части",
+        operation_summary="Сессия загрузки",
+        tags=['Upload'],
+        responses={
+            204: 'Сессия удалена',
+            404: 'Сессия не найдена'
+        }
+    )
+    def delete(self, request, pk, format=None):
+        session = self.get_session(request, pk)
+        session.delete()
+        discard_session_files(pk)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadChunkView(UploadSessionMixin, APIView):
+    permission_classes = [IsAuthenticated, ]
+
+    @swagger_auto_schema(
+        operation_description="Дописывает часть файла. Тело запроса - байты части, заголовок Content-Range "
+                              "(bytes <начало>-<конец>/<размер>) должен начинаться с уже полученного числа байт, "
+                              "X-Chunk-SHA256 - хеш части",
+        operation_summary="Часть файла",
+        tags=['Upload'],
+        manual_parameters=[
+            openapi.Parameter('Content-Range', in_=openapi.IN_HEADER, required=True, type=openapi.TYPE_STRING),
+            openapi.Parameter('X-Chunk-SHA256', in_=openapi.IN_HEADER, required=True, type=openapi.TYPE_STRING),
+        ],
+        responses={
+            200: 'Число полученных байт файла',
+            400: 'Неверный диапазон или хеш',
+            404: 'Сессия или файл не найдены',
+            409: 'Часть не начинается с полученного числа байт'
+        }
+    )
+    def put(self, request, pk, index, format=None):
+        session = self.get_session(request, pk)
+        if index >= len(session.files):
+            raise Http404
+        # the body is read straight from the stream, request.data is never parsed
+        received = append_chunk(
+            session, index, request.stream,
+            request.META.get('HTTP_CONTENT_RANGE'), request.META.get(CHECKSUM_HEADER),
+        )
+        return Response({'index': index, 'received': received})
+
+
+class UploadSessionFinalizeView(UploadSessionMixin, APIView):
+    permission_classes = [IsAuthenticated, ]
+
+    @swagger_auto_schema(
+        operation_description="Создает серию фото из полностью загруженных файлов сессии и удаляет сессию",
+        operation_summary="Завершение загрузки",
+        tags=['Upload'],
+        responses={
+            201: PhotoSeriesSerializer,
+            400: 'Плохой запрос',
+            404: 'Сессия не найдена',
+            409: 'Не все файлы загружены'
+        }
+    )
+    def post(self, request, pk, format=None):
+        session = self.get_session(request, pk)
+        incomplete = incomplete_files(session)
+        if incomplete:
+            raise UploadConflict({'detail': 'Some files are not fully uploaded.', 'incomplete': incomplete})
+
+        files = [File(open(part_path(session, index), 'rb'), name=file['name'])
+                 for index, file in enumerate(session.files)]
+        try:
+            with transaction.atomic():
+                # deleting first makes a concurrent finalize of the same session a 404
+                if not UploadSession.objects.filter(pk=session.pk).delete()[0]:
+                    raise Http404
+                serializer = PhotoSeriesSerializer(
+                    data=session.series_data, context={'request': request, 'series_photos': files},
+                )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+        finally:
+            for file in files:
+                file.close()
+        discard_session_files(session.pk)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class JobView(APIView):
+    permission_classes = [IsAuthenticated, ]
+
+    @swagger_auto_schema(
+        operation_description="Возвращает состояние фоновой задачи, например обработки загруженных фото",
+        operation_summary="Фоновая задача",
+        tags=['Jobs'],
+        responses={
+            200: JobSerializer,
+            404: 'Задача не найдена'
+        }
+    )
+    def get(self, request, pk, format=None):
+        jobs = Job.objects.all() if request.user.is_staff else Job.objects.filter(owner=request.user)
+        try:
+            job = jobs.get(pk=pk)
+        except Job.DoesNotExist:
+            raise Http404
+        return Response(JobSerializer(job).data)
+
+
 class PhotoSeriesMainPageView(APIView):
     # permission_classes = [IsNotSecret] # nn?
 
     @swagger_auto_schema(
-        operation_description="Возвращает главную страницу/главную страницу по заданным тегам",
+        operation_description="Возвращает главную страницу/главную страницу по заданным тегам. Лента перемешана "
+                              "случайно, курсор следующей страницы возвращается в заголовке X-Next-Cursor",
         operation_summary="Главная страница",
         tags=['Main Page'],
         manual_parameters=[
+            openapi.Parameter(
+                'cursor',
+                description='Курсор страницы из заголовка X-Next-Cursor',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+            ),
             openapi.Parameter(
                 'page',
-                description='Номер страницы',
+                description='Номер страницы результатов поиска',
                 in_=openapi.IN_QUERY,
                 type=openapi.TYPE_INTEGER,
             ),
@@ -265,9 +471,16 @@ class PhotoSeriesMainPageView(APIView):
                     type=openapi.TYPE_INTEGER
                 )
             ),
+            openapi.Parameter(
+                'tag_mode',
+                description='and - серии со всеми тегами (по умолчанию), or - хотя бы с одним',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+                enum=['and', 'or'],
+            ),
             openapi.Parameter(
                 'search_query',
-                description='Поисковый запрос',
+                description='Поисковый запрос по названию, описанию и тегам, результаты отсортированы по релевантности',
                 in_=openapi.IN_QUERY,
                 type=openapi.TYPE_STRING,
             )
@@ -281,28 +494,87 @@ class PhotoSeriesMainPageView(APIView):
         }
     )
     def get(self, request, format=None):
-        series = PhotoSeries.objects.filter(Q(collection__is_secret=False) | Q(collection__isnull=True))
+        series = PhotoSeries.objects.public()
+        series = PhotoSeriesShortSerializer.setup_eager_loading(series)
 
         if request.query_params:
             tags = request.query_params.getlist("tag_id")
             if tags:
-                tags = tags[0].split(',')
-                for tag in tags:
-                    series = series.filter(tag__id=int(tag))
+                try:
+                    tags = [int(tag) for tag in tags[0].split(',')]
+                except ValueError:
+                    return Response(status=status.HTTP_400_BAD_REQUEST)
+                match_all = request.query_params.get("tag_mode", "and") != "or"
+                series = filter_series_by_tags(series, tags, match_all)
 
             search_query = request.query_params.getlist("search_query")
             if search_query:
-                for search in search_query:
-                    series = series.filter(name__icontains=search)
+                series = search_series(series, ' '.join(search_query))
 
-        series = list(series)
-        paginator = PageNumberPagination()
+                # search results are ordered by relevance instead of the random feed order
+                paginator = PageNumberPagination()
+                paginator.page_size = 10
+
+                result_page = paginator.paginate_queryset(series, request)
+                serializer = PhotoSeriesShortSerializer(result_page, many=True)
+                return Response(serializer.data)
+
+        paginator = RandomFeedPagination()
         paginator.page_size = 10
 
-        shuffle(series)
         result_page = paginator.paginate_queryset(series, request)
         serializer = PhotoSeriesShortSerializer(result_page, many=True)
-        return Response(serializer.data)
+        return paginator.add_cursor_header(Response(serializer.data))
+
+
+class TimelineView(APIView):
+    permission_classes = [IsAuthenticated, ]
+    page_size = 20
+
+    @swagger_auto_schema(
+        operation_description="Возвращает новые серии пользователей, на которых подписан текущий пользователь, "
+                              "от новых к старым. Курсор следующей страницы возвращается в заголовке X-Next-Cursor",
+        operation_summary="Лента подписок",
+        tags=['Main Page', 'Subscription'],
+        manual_parameters=[
+            openapi.Parameter(
+                'cursor',
+                description='Курсор страницы из заголовка X-Next-Cursor',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+            ),
+        ],
+        responses={
+            200: PhotoSeriesShortSerializer(many=True),
+            404: 'Неверный курсор',
+        }
+    )
+    def get(self, request, format=None):
+        after = None
+        encoded = request.query_params.get('cursor')
+        if encoded:
+            tokens = decode_cursor(encoded)
+            try:
+                after = (parse_datetime(tokens['t']), int(tokens['i']))
+            except (KeyError, TypeError, ValueError):
+                raise Http404
+            if after[0] is None:
+                raise Http404
+
+        page = read_timeline(request.user, after, self.page_size + 1)
+        next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            next_cursor = encode_cursor({'t': page[-1][0].isoformat(), 'i': page[-1][1]})
+
+        series = PhotoSeriesShortSerializer.setup_eager_loading(
+            PhotoSeries.objects.filter(pk__in=[pk for _, pk in page])
+        ).in_bulk()
+        serializer = PhotoSeriesShortSerializer([series[pk] for _, pk in page if pk in series], many=True)
+        response = Response(serializer.data)
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+        return response
 
 
 # Collection views
@@ -320,7 +592,13 @@ class CollectionView(APIView):
                 in_=openapi.IN_PATH,
                 required=True,
                 type=openapi.TYPE_INTEGER,
-            )
+            ),
+            openapi.Parameter(
+                'cursor',
+                description='Курсор страницы серий из поля collections_series_cursor',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+            ),
         ],
         responses={
             200: openapi.Response(
@@ -358,7 +636,10 @@ class CollectionView(APIView):
             collection = Collection.objects.get(pk=pk)
         except Exception as e:
             raise Http404
-        serializer = CollectionRetrieveSerializer(collection)
+        if collection.is_secret and not (request.user.pk == collection.owner_id or request.user.is_staff):
+            raise Http404
+        CollectionRetrieveSerializer.setup_series_page(collection, request)
+        serializer = CollectionRetrieveSerializer(collection, context={'request': request})
         return Response(serializer.data)
 
     @swagger_auto_schema(
@@ -392,7 +673,7 @@ class CollectionView(APIView):
             return Response(status=status.HTTP_403_FORBIDDEN)
 
     @swagger_auto_schema(
-        operation_description="Возвращает коллекцию по её id",
+        operation_description="Добавляет и убирает серии коллекции и меняет их порядок",
         operation_summary="Коллекция",
         tags=['Collections'],
         manual_parameters=[
@@ -404,43 +685,46 @@ class CollectionView(APIView):
                 type=openapi.TYPE_INTEGER,
             ),
         ],
-        request_body=openapi.Schema(
-            'series',
-            type=openapi.TYPE_OBJECT,
-            properties={
-                'series_id': openapi.Schema(
-                    description='id серии',
-                    in_=openapi.IN_BODY,
-                    type=openapi.TYPE_ARRAY,
-                    items=openapi.Schema(type=openapi.TYPE_INTEGER))
-            },
-        ),
+        request_body=CollectionSeriesUpdateSerializer,
         responses={
-            200: 'Серия добавлена',
+            200: openapi.Response(
+                'Серии коллекции изменены',
+                schema=openapi.Schema(
+                    'CollectionSeries',
+                    type=openapi.TYPE_OBJECT,
+                    properties={
+                        'collections_series': openapi.Schema(
+                    description='id серий коллекции по порядку',
+                    type=openapi.TYPE_ARRAY,
+                    items=openapi.Schema(type=openapi.TYPE_INTEGER)),
+                    }
+                ),
+            ),
+            400: 'Серии не найдены или не принадлежат хозяину коллекции',
             404: 'Коллекция не найдена',
             403: 'Доступ запрещен'
         }
     )
     def patch(self, request, pk, format=None):
-        try:
-            collection = Collection.objects.get(pk=pk)
-        except Exception as e:
-            raise Http404
-        print(request.data)
-        if request.user == collection.owner or request.user.is_staff:
-            series_ids = request.data.get("series_id")
-            print(series_ids)
-            if series_ids:
-            #     for series_id in series_ids:
-            #         collection.collections_series.add(series_id)
-                return Response(status=status.HTTP_200_OK)
-            else:
-                return Response(status=status.HTTP_404_NOT_FOUND)
-        else:
-            return Response(status=status.HTTP_403_FORBIDDEN)
-
-
-class CollectionCreateView(APIView):
+        serializer = CollectionSeriesUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            try:
+                collection = Collection.objects.select_for_update().get(pk=pk)
+            except Collection.DoesNotExist:
+                raise Http404
+            if not (request.user == collection.owner or request.user.is_staff):
+                return Response(status=status.HTTP_403_FORBIDDEN)
+            unknown = collection.update_series(**serializer.validated_data)
+            if unknown:
+                return Response({'add': [f'Series {pk} not found.' for pk in unknown]},
+                                status=status.HTTP_400_BAD_REQUEST)
+            series_ids = list(CollectionSeries.objects.filter(collection=collection)
+                              .order_by('order', 'pk').values_list('photoseries_id', flat=True))
+        return Response({'collections_series': series_ids})
+
+
+class CollectionCreateView(StreamingUploadMixin, APIView):
     permission_classes = [IsAuthenticated, ]
     parser_classes = (MultiPartParser, )
 
@@ -574,19 +858,20 @@ class UserPhotoSeries(APIView):
     def get(self, request, user_pk, format=None):
         try:
             user_photo_series = PhotoSeries.objects.filter(owner__id=user_pk).order_by('created_at')
+            user_photo_series = PhotoSeriesShortSerializer.setup_eager_loading(user_photo_series)
         except Exception as e:
             print(e)
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
         if request.user.id != user_pk:
-            user_photo_series = user_photo_series.filter(Q(collection__is_secret=False) | Q(collection__isnull=True))
+            user_photo_series = user_photo_series.public()
 
         paginator = PageNumberPagination()
         paginator.page_size = 9
 
         result_page = paginator.paginate_queryset(user_photo_series, request)
 
-        serializer = PhotoSeriesShortSerializer(result_page, many=True)
+        serializer = PhotoSeriesShortSerializer(result_page, many=True, context={'request': request})
         return Response(serializer.data)
 
 
@@ -631,7 +916,7 @@ class UserCollections(APIView):
 
         result_page = paginator.paginate_queryset(user_collections, request)
 
-        serializer = CollectionSerializer(result_page, many=True)
+        serializer = CollectionSerializer(result_page, many=True, context={'request': request})
         return Response(serializer.data)
 
 
@@ -725,12 +1010,93 @@ class UserSubscribersView(APIView):
     )
     def get(self, request, user_pk, format=None):
         try:
-            user_subscribers = User.objects.get(pk=user_pk)
+            user_subscribers = User.objects.only('subscribers_count', 'subscribed_to_count').get(pk=user_pk)
         except Exception as e:
             raise Http404
-        subscribers_count = user_subscribers.subscribers.count()
-        subscribed_to_count = user_subscribers.subscribed_to.count()
-        return JsonResponse({"subscribers": subscribers_count, "subscribed_to": subscribed_to_count})
+        return JsonResponse({
+            "subscribers": user_subscribers.subscribers_count,
+            "subscribed_to": user_subscribers.subscribed_to_count,
+        })
+
+
+class UserSubscriptionListView(APIView):
+    # the Subscription column of the requested user and the column of the listed users
+    user_field = None
+    listed_field = None
+
+    def get(self, request, user_pk, format=None):
+        if not User.objects.filter(pk=user_pk).exists():
+            raise Http404
+        paginator = SubscriptionPagination()
+        rows = Subscription.objects.filter(**{self.user_field: user_pk}).select_related(self.listed_field)
+        page = paginator.paginate_queryset(rows, request)
+        serializer = UserShortSerializer([getattr(row, self.listed_field) for row in page], many=True,
+                                         context={'request': request})
+        return paginator.add_cursor_header(Response(serializer.data))
+
+
+class UserSubscribersListView(UserSubscriptionListView):
+    user_field = 'from_user'
+    listed_field = 'to_user'
+
+    @swagger_auto_schema(
+        operation_description="Возвращает подписчиков пользователя в порядке подписки. "
+                              "Курсор следующей страницы возвращается в заголовке X-Next-Cursor",
+        operation_summary="Подписчики пользователя",
+        tags=['User', 'Subscription'],
+        manual_parameters=[
+            openapi.Parameter(
+                'user_pk',
+                description='id юзера',
+                in_=openapi.IN_PATH,
+                type=openapi.TYPE_INTEGER,
+            ),
+            openapi.Parameter(
+                'cursor',
+                description='Курсор страницы из заголовка X-Next-Cursor',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+            ),
+        ],
+        responses={
+            200: UserShortSerializer(many=True),
+            404: 'Юзер не найден'
+        }
+    )
+    def get(self, request, user_pk, format=None):
+        return super().get(request, user_pk, format)
+
+
+class UserFollowingListView(UserSubscriptionListView):
+    user_field = 'to_user'
+    listed_field = 'from_user'
+
+    @swagger_auto_schema(
+        operation_description="Возвращает пользователей, на которых подписан пользователь, в порядке подписки. "
+                              "Курсор следующей страницы возвращается в заголовке X-Next-Cursor",
+        operation_summary="Подписки пользователя",
+        tags=['User', 'Subscription'],
+        manual_parameters=[
+            openapi.Parameter(
+                'user_pk',
+                description='id юзера',
+                in_=openapi.IN_PATH,
+                type=openapi.TYPE_INTEGER,
+            ),
+            openapi.Parameter(
+                'cursor',
+                description='Курсор страницы из заголовка X-Next-Cursor',
+                in_=openapi.IN_QUERY,
+                type=openapi.TYPE_STRING,
+            ),
+        ],
+        responses={
+            200: UserShortSerializer(many=True),
+            404: 'Юзер не найден'
+        }
+    )
+    def get(self, request, user_pk, format=None):
+        return super().get(request, user_pk, format)
 
 
 class UserShortInfo(APIView):
@@ -752,25 +1118,72 @@ class UserShortInfo(APIView):
         }
     )
     def get(self, request, user_pk, format=None):
-        try:
-            user = User.objects.get(pk=user_pk)
-        except Exception as e:
+        info = get_short_infos([user_pk]).get(user_pk)
+        if info is None:
             raise Http404
-        serializer = UserShortSerializer(user)
-        return Response(serializer.data)
+        return Response(info)
+
 
+class UserShortInfoBatch(APIView):
+    max_ids = 100
+
+    @swagger_auto_schema(
+        operation_description="Возвращает короткую информацию о нескольких пользователях в порядке ids, "
+                              "несуществующие пользователи пропускаются",
+        operation_summary="Пользователи",
+        tags=['User', ],
+        manual_parameters=[
+            openapi.Parameter(
+                'ids',
+                description='id юзеров через запятую, не больше 100',
+                in_=openapi.IN_QUERY,
+                required=True,
+                type=openapi.TYPE_STRING,
+            ),
+        ],
+        responses={
+            200: UserShortSerializer(many=True),
+            400: 'Плохой запрос',
+        }
+    )
+    def get(self, request, format=None):
+        try:
+            ids = list(dict.fromkeys(int(pk) for pk in request.query_params.get('ids', '').split(',') if pk))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if not ids or len(ids) > self.max_ids:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        infos = get_short_infos(ids)
+        return Response([infos[pk] for pk in ids if pk in infos])
+
+
+class UserActivationView(View):
+    """
+    Page behind the activation link of the djoser activation email. Does
+    what djoser's users/activation/ endpoint does, in this request.
+    """
+    # read by djoser's UidAndTokenSerializer
+    token_generator = default_token_generator
 
-class UserActivationView(APIView):
     def get(self, request, uid, token):
-        protocol = 'https://' if request.is_secure() else 'http://'
-        print(protocol)
-        web_url = protocol + request.get_host()
-        post_url = web_url + "/api/auth/users/activation/"
-        print(post_url)
-        post_data = {'uid': uid, 'token': token}
-        result = requests.post(post_url, data=post_data)
-        content = result.text
-        return Response(content)
+        serializer = djoser_settings.SERIALIZERS.activation(
+            data={'uid': uid, 'token': token}, context={'request': request, 'view': self},
+        )
+        try:
+            serializer.is_valid(raise_exception=True)
+        except PermissionDenied:
+            # the token of an already active user
+            return render(request, 'api/activation.html', {'result': 'stale'}, status=status.HTTP_403_FORBIDDEN)
+        except ValidationError:
+            return render(request, 'api/activation.html', {'result': 'invalid'}, status=status.HTTP_400_BAD_REQUEST)
+
+        user = serializer.user
+        user.is_active = True
+        user.save()
+        djoser_signals.user_activated.send(sender=self.__class__, user=user, request=request)
+        if djoser_settings.SEND_CONFIRMATION_EMAIL:
+            djoser_settings.EMAIL.confirmation(request, {'user': user}).send([get_user_email(user)])
+        return render(request, 'api/activation.html', {'result': 'activated'})
 
 #
 # class UserPasswordResetView(View):
@@ -34,6 +34,7 @@ ALLOWED_HOSTS = os.environ.get("DJANGO_ALLOWED_HOSTS", "localhost 127.0.0.1 [::1
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_ALLOW_CREDENTIALS = False
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor']
 
 CSRF_COOKIE_SECURE = False
 
@@ -118,6 +119,19 @@ DATABASES = {
     }
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # trigram lookups used by api.search
+    INSTALLED_APPS.append('django.contrib.postgres')
+
+# per process by default: the user short info, JWT user and media visibility caches are disabled until
+# CACHE_BACKEND names a backend shared by all workers (memcached, database, file), see api.caches.shared_cache
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.environ.get("CACHE_LOCATION", ""),
+    }
+}
+
 # email validation
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
@@ -190,12 +204,43 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Media files path
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = 'api.storage.ContentAddressedStorage'
+# seconds a signed media url stays valid at least (and twice as long at most)
+MEDIA_URL_SIGNATURE_TTL = int(os.environ.get("MEDIA_URL_SIGNATURE_TTL", 3600))
+# cache of user short infos (api.user_cache), only enabled when the alias is shared by all workers;
+# shorter than the signature ttl so the cached media urls stay valid
+USER_SHORT_INFO_CACHE_ALIAS = os.environ.get("USER_SHORT_INFO_CACHE_ALIAS", "default")
+USER_SHORT_INFO_CACHE_TIMEOUT = min(300, MEDIA_URL_SIGNATURE_TTL // 4)
+# active and staff flags of JWT users, see api.authentication; only enabled when the alias is shared by all workers
+AUTH_USER_CACHE_ALIAS = os.environ.get("AUTH_USER_CACHE_ALIAS", "default")
+AUTH_USER_CACHE_TIMEOUT = 60
+# processes rendering image placeholders in backfill_placeholders
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 2))
+# seconds a running background job may take before another worker retries it, see api.jobs
+JOB_LEASE = int(os.environ.get("JOB_LEASE", 3600))
+# path -> visibility cache of MediaAccess, only enabled when the alias is shared by all workers
+# (disabled with the default LocMemCache, every check then reads the database)
+MEDIA_VISIBILITY_CACHE_ALIAS = os.environ.get("MEDIA_VISIBILITY_CACHE_ALIAS", "default")
+MEDIA_VISIBILITY_CACHE_TIMEOUT = 300
+# byte caps of uploaded images, see api.upload_handlers
+UPLOAD_MAX_FILE_SIZE = int(os.environ.get("UPLOAD_MAX_FILE_SIZE", 50 * 1024 * 1024))
+UPLOAD_MAX_REQUEST_SIZE = int(os.environ.get("UPLOAD_MAX_REQUEST_SIZE", 200 * 1024 * 1024))
+# chunked photo series uploads, see api.uploads
+UPLOAD_SESSION_MAX_FILES = 100
+# seconds after the last received chunk before gc_upload_sessions drops a session
+UPLOAD_SESSION_TTL = int(os.environ.get("UPLOAD_SESSION_TTL", 24 * 3600))
+
+# accounts with more subscribers are not pushed into timelines, their series are read on request, see api.timeline
+TIMELINE_FANOUT_LIMIT = int(os.environ.get("TIMELINE_FANOUT_LIMIT", 10000))
+TIMELINE_BATCH_SIZE = 1000
+# latest series of an account copied into the timeline of a new subscriber
+TIMELINE_BACKFILL = 20
 
 AUTH_USER_MODEL = "api.User"
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (